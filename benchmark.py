@@ -0,0 +1,517 @@
+# Benchmarks for the weather page hot paths
+# Run with: python benchmark.py [--output results.json] [--compare baseline.json] [--filter name] [--quick] [--check]
+# Every benchmark runs offline, on a seeded synthetic corpus and on the recorded feeds in feeds/
+# (plus weather_page.tti), at several sizes. Results can be saved as JSON and compared between commits.
+
+import re, timeit, json, glob, os, sys, time, random, platform, statistics, subprocess, tempfile, argparse
+from legaliser import charsub, pageLegaliser, legaliseText, coalesceEnhancements, write_enhancements
+from textBlock import toTeletextBlock, textColour, tableRow, TableFormatter, LayoutCache
+from page import loadTTI, exportTTI, teletextDeMinify, teletextMinify, blockOverlay
+import metrics
+
+# A realistic corpus of Dutch weather text, as it comes out of the buienradar feed
+corpus = [
+	"Temperatuur: 12.4 °C",
+	"Bewolking: 75%",
+	"Luchtvochtigheid: 88%",
+	"Windsnelheid: 18.7 km/u (ZZW)",
+	"Neerslagkans: Kans op neerslag",
+	"Meetstation Schiphol",
+	"Meetstation Hoek van Holland",
+	"Meetstation Vlieland",
+	"Weerbericht: Vanochtend hier en daar mist, in de loop van de dag zon en wolken. Middagtemperatuur rond 14 °C.",
+	"Vannacht droog en helder – later in het noorden wat buien… Zwakke tot matige zuidwestenwind, kracht 3 à 4.",
+	"Morgen: zonnige perioden en  enkele  buien, kans op onweer. Maximumtemperatuur 17 °C",
+	"Zaterdag: wisselvallig weer met regen & wind; temperaturen ‘normaal’ voor de tijd van het jaar",
+	"Het KNMI geeft code geel af voor de Waddeneilanden &amp; Noord-Holland vanwege zware windstoten",
+	"Enkele opklaringen — vooral in het zuidoosten. Temperatuur 9° à 12°",
+	"  Wind: ONO 4 Bft  ",
+	"Zicht: 6.2 km",
+	"Luchtdruk: 1013.2 hPa",
+	"Zon op: 07:42 · Zon onder: 18:37",
+]
+
+# charsub as it was before it was compiled, kept verbatim as the baseline: one str.replace or re.sub per substitution, in order
+def legacyCharsub(text):
+	if type(text) is not str:
+		print("legaliser tried to charsub something that's not text!")
+		return text
+	
+	text = re.sub(r"^\s+|\s+$|\s+(?=\s)","",text)	# Remove extraneous whitespace
+	
+	# do any substitutitons that will change the length of the text
+	#text = text.replace("­", "") # strip soft hyphens as wrapping text is hard enough already   -- Uh, no? Kinda necessary for our purposes
+	text = text.replace("…", "...")
+	text = text.replace("&lt;", "<")
+	text = text.replace("&gt;", ">")
+	text = text.replace("&amp;", "&")
+	text = text.replace(" ", " ") # Non-line-breaking space
+	text = text.replace("\r\n", " ")
+	text = text.replace("\r", " ")
+
+	# digraphs and ligatures
+	text = text.replace("Ǳ", "DZ")
+	text = text.replace("ǲ", "Dz")
+	text = text.replace("ǳ", "dz")
+	text = text.replace("Ǆ", "DŽ")
+	text = text.replace("ǅ", "Dž")
+	text = text.replace("ǆ", "dž")
+	#text = text.replace("Ĳ", "IJ") # supported in Latin G2
+	#text = text.replace("ĳ", "ij") # supported in Latin G2
+	text = text.replace("Ǉ", "LJ")
+	text = text.replace("ǈ", "Lj")
+	text = text.replace("ǉ", "lj")
+	text = text.replace("Ǌ", "NJ")
+	text = text.replace("ǋ", "Nj")
+	text = text.replace("ǌ", "nj")
+	text = text.replace("ᵺ", "th")
+	text = text.replace("Ꜳ", "AA")
+	text = text.replace("ꜳ", "aa")
+	#text = text.replace("Æ", "AE") # supported in Latin G2
+	#text = text.replace("æ", "ae") # supported in Latin G2
+	text = text.replace("Ꜵ", "AO")
+	text = text.replace("ꜵ", "ao")
+	text = text.replace("Ꜷ", "AU")
+	text = text.replace("ꜷ", "au")
+	text = text.replace("Ꜹ", "AV")
+	text = text.replace("ꜹ", "av")
+	text = text.replace("Ꜻ", "AV")
+	text = text.replace("ꜻ", "av")
+	text = text.replace("Ꜽ", "AY")
+	text = text.replace("ꜽ", "ay")
+	text = text.replace("🙰", "et")
+	text = text.replace("ﬀ", "ff")
+	text = text.replace("ﬃ", "ffi")
+	text = text.replace("ﬄ", "ffl")
+	text = text.replace("ﬁ", "fi")
+	text = text.replace("ﬂ", "fl")
+	text = text.replace("Ƕ", "Hv")
+	text = text.replace("ƕ", "hv")
+	text = text.replace("℔", "lb")
+	text = text.replace("Ỻ", "lL")
+	text = text.replace("ỻ", "ll")
+	#text = text.replace("Œ", "OE") # supported in Latin G2
+	#text = text.replace("œ", "oe") # supported in Latin G2
+	text = text.replace("Ꝏ", "OO")
+	text = text.replace("ꝏ", "oo")
+	text = text.replace("ﬆ", "st")
+	text = text.replace("ﬅ", "ft")
+	text = text.replace("Ꜩ", "TZ")
+	text = text.replace("ꜩ", "tz")
+	text = text.replace("ᵫ", "ue")
+	text = text.replace("ꭣ", "uo")
+	text = text.replace("Ꝡ", "VY")
+	text = text.replace("ꝡ", "vy")
+
+	# map similar characters to one canonical unicode point
+	text = text.replace("€", "₠")
+	text = re.sub("[··᛫‧∙⋅⋅⸱⸳・ꞏ]","·",text,flags=re.UNICODE)
+	text = text.replace("•", "●")
+	text = text.replace("Ș", "Ş")
+	text = text.replace("ș", "ş")
+	text = text.replace("Å", "Å")
+	text = text.replace("„", "”")
+	text = text.replace("‟", "“")
+	text = text.replace("‘", "'")
+	text = text.replace("’", "'")
+	text = re.sub("[‒–—]","―",text,flags=re.UNICODE) # dashes to horizontal bar
+
+	# emoji stuff
+	text = re.sub("[😊☺]","🙂",text,flags=re.UNICODE) # like slightly smiling face
+	text = re.sub("[😁😃😄😆]","😀",text,flags=re.UNICODE) # like grinning face
+	text = text.replace("😝", "😛") # face with tongue
+	text = text.replace("🤣", "😂") # rofl -> face with tears of joy
+	text = text.replace("🤓", "😎") # nerd -> sunglasses
+	text = re.sub("[☹😦]","🙁",text,flags=re.UNICODE) # like slightly frowning face
+	text = re.sub("[😭😥]", "😢",text,flags=re.UNICODE) # like crying face
+	text = re.sub("[🤚👋🖐]","✋",text,flags=re.UNICODE) # like raised hand
+	text = re.sub("[♡♥🎔💓💖💗💘💙💚💛💜💝💟🖤🧡]","❤",text,flags=re.UNICODE) # like heavy black heart
+	text = re.sub("["u"\U0000FE00-\U0000FE0F]","",text,flags=re.UNICODE) # strip variation selectors
+
+	return text
+
+def benchCharsub(number=2000):
+	for text in corpus:
+		if legacyCharsub(text) != charsub(text):
+			print("charsub: output differs from legacy for " + repr(text))
+
+	legacy = timeit.timeit(lambda: [legacyCharsub(text) for text in corpus], number=number)
+	compiled = timeit.timeit(lambda: [charsub(text) for text in corpus], number=number)
+
+	calls = number * len(corpus)
+	print("charsub (legacy):   %.2f us/call" % (legacy / calls * 1e6))
+	print("charsub (compiled): %.2f us/call" % (compiled / calls * 1e6))
+	print("charsub speedup:    %.1fx" % (legacy / compiled))
+
+# A page full of accented station names, spread over a few subpages
+def stationPage(subpages=4):
+	names = ["Meetstation Schiphol", "Meetstation Hoek van Holland", "Meetstation Vlieland", "Meetstation Arcen", "Meetstation Hupsel", "Meetstation Lelystad"]
+	page = {"number":300,"packets":[{"number":24,"text":chr(1) + "Weerdata: © buienradar.nl · KNMI"}],"subpages":[]}
+	for subcode in range(subpages):
+		packets = [{"number":1,"text":chr(20) + "`ppp0" + chr(7) + "Weer " + str(subcode + 1)}]
+		for row, name in enumerate(names):
+			packets.append({"number":row + 5,"text":chr(3) + name + " – " + str(10 + row) + "° Zuidwest, één à twee Bft"})
+		page["subpages"].append({"packets":packets})
+	return page
+
+def benchPageLegaliser(number=500):
+	page = stationPage()
+	
+	if pageLegaliser(page) != pageLegaliser(page, fast=True):
+		print("pageLegaliser: fast mode output differs")
+	
+	copied = timeit.timeit(lambda: pageLegaliser(page), number=number)
+	fast = timeit.timeit(lambda: pageLegaliser(page, fast=True), number=number)
+	
+	print("pageLegaliser (deep copy): %.1f us/page" % (copied / number * 1e6))
+	print("pageLegaliser (fast):      %.1f us/page" % (fast / number * 1e6))
+
+# write_enhancements as it was before coalescing, kept verbatim for the before/after counts
+def legacyWriteEnhancements(enhancements):
+	packets = []
+	for p in range(15): # up to 15 enhancement packets per subpage
+		packet = chr(0x40 + p) # first byte is designation code
+		for e in range(13): # up to 13 triplets per enhancement packet
+			if len(enhancements) > p*13+e:
+				# combine parts of enhancement data into an 18 byte triplet, then slice it up into three 6 byte values to write to the row with bit 6 set
+				triplet = enhancements[p*13+e][0] | ((enhancements[p*13+e][1]) << 6) | ((enhancements[p*13+e][2]) << 11)
+				packet+=chr(0x40+(triplet&0x3F))+chr(0x40+((triplet>>6)&0x3F))+chr(0x40+((triplet>>12)&0x3F))
+			elif e == 0:
+				# TODO: generate packet of terminators if previous packet is full.
+				return packets
+			else:
+				packet+=chr(0x7f)+chr(0x7f)+chr(0x7f)
+		packets.append(packet)
+	
+	return packets
+
+# The triplet list the old pageLegaliser built: a row address triplet before every enhanced character
+def legacyEnhancements(enhancementRows):
+	enhancements = []
+	for row in sorted(enhancementRows):
+		for column in enhancementRows[row]:
+			enhancements.append([row+40,4,0])
+			enhancements.append(column)
+	return enhancements
+
+# Packet 26 packets back to (address, mode, data) triplets
+def decodeTriplets(packets):
+	triplets = []
+	for packet in packets:
+		for i in range(1, len(packet), 3):
+			value = (ord(packet[i]) - 0x40) | ((ord(packet[i+1]) - 0x40) << 6) | ((ord(packet[i+2]) - 0x40) << 12)
+			triplets.append((value & 0x3f, (value >> 6) & 0x1f, value >> 11))
+	return triplets
+
+terminatorTriplet = (63, 31, 0x7f)
+
+def denseRows(rows):
+	enhancementRows = {}
+	for row in rows:
+		legaliseText("Één ës à là çà où Ålësünd Ðañsk", enhancementRows.setdefault(row,[]))
+	return enhancementRows
+
+class CheckFailed(Exception):
+	pass
+
+# Not assert, so the checks still run under python -O
+def check(condition, message):
+	if not condition:
+		raise CheckFailed(message)
+
+# Check the packet 26 encoder on pages dense with diacritics, and count triplets before and after coalescing
+def checkEnhancements():
+	# One row address triplet per row, followed by exactly that row's column triplets
+	enhancementRows = denseRows(range(2,10))
+	page = pageLegaliser({"number":300,"subpages":[{"packets":[{"number":row,"text":"Één ës à là çà où Ålësünd Ðañsk"} for row in range(2,10)]}]})
+	triplets = decodeTriplets([packet["text"] for packet in page["subpages"][0]["packets"] if packet["number"] == 26])
+	decoded = {}
+	row = None
+	for address, mode, data in triplets:
+		if (address, mode, data) == terminatorTriplet:
+			continue
+		if mode == 4 and address >= 40:
+			check(address - 40 not in decoded, "row " + str(address - 40) + " has more than one row address triplet")
+			row = decoded.setdefault(address - 40, [])
+		else:
+			check(row is not None, "column triplet before the first row address triplet")
+			row.append([address, mode, data])
+	check(decoded == enhancementRows, "decoded enhancements don't match the legalised rows")
+	
+	# Row 24 is address 40; row 0 and rows past 24 have no row address and are dropped
+	addresses = [triplet[0] for triplet in coalesceEnhancements({0:[[1,0x12,0x65]], 24:[[1,0x12,0x65]], 25:[[1,0x12,0x65]]}) if triplet[1] == 4]
+	check(addresses == [40], "unaddressable rows were encoded: " + str(addresses))
+	
+	# A packet filled exactly is followed by a packet of terminators
+	packets = write_enhancements(coalesceEnhancements({1:[[column,0x12,0x65] for column in range(12)]}))
+	check(len(packets) == 2 and packets[1][0] == chr(0x41), "no terminator packet after a full packet")
+	check(decodeTriplets(packets[1:]) == [terminatorTriplet] * 13, "the terminator packet isn't all terminators")
+	
+	# Past 194 triplets the rest is dropped and counted, and the last packet still ends in a terminator
+	enabled, metrics.enabled = metrics.enabled, True
+	dropped = metrics.counters.get("enhancement_triplets_dropped", 0)
+	try:
+		packets = write_enhancements([[column % 40,0x12,0x65] for column in range(200)])
+	finally:
+		metrics.enabled = enabled
+	check(metrics.counters.get("enhancement_triplets_dropped", 0) - dropped == 200 - 194, "dropped triplets weren't counted")
+	check(len(packets) == 15 and decodeTriplets(packets)[194:] == [terminatorTriplet], "a full page of triplets isn't 15 packets ending in a terminator")
+	
+	# Before and after, on a full page
+	enhancementRows = denseRows(range(2,23))
+	columns = sum(map(len, enhancementRows.values()))
+	for name, triplets in (("one row address per character", decodeTriplets(legacyWriteEnhancements(legacyEnhancements(enhancementRows)))), ("coalesced", decodeTriplets(write_enhancements(coalesceEnhancements(enhancementRows))))):
+		written = [triplet for triplet in triplets if triplet != terminatorTriplet]
+		characters = sum(1 for triplet in written if triplet[0] < 40)
+		print("packet 26 (%s): %d triplets, %d of %d characters enhanced" % (name, len(written), characters, columns))
+
+# Corpora
+# "synthetic" is generated from a fixed seed, so it's the same on every run and every machine.
+# "recorded" is the text of the buienradar feeds kept in feeds/ and the weather page template.
+
+sizes = (1, 4, 16)	# Subpages per page, for the page level benchmarks
+
+def recordedTexts():
+	texts = []
+	for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "feeds", "*.json"))):
+		with open(filename, encoding="utf-8") as f:
+			feed = json.load(f)
+		for station in feed.get("actual", {}).get("stationmeasurements", []):
+			texts.append(station.get("stationname", "") + " (" + station.get("regio", "") + "): " + str(station.get("temperature")) + " °C, " + station.get("weatherdescription", ""))
+		forecast = feed.get("forecast", {})
+		for section in ("weatherreport", "shortterm", "longterm"):
+			for key in ("title", "summary", "text", "forecast"):
+				if isinstance(forecast.get(section, {}).get(key), str):
+					texts.append(forecast[section][key])
+	return texts or list(corpus)
+
+def syntheticTexts(count=200, seed=1):
+	generator = random.Random(seed)
+	words = [word for text in corpus for word in text.split()]
+	return [" ".join(generator.choice(words) for _ in range(generator.randint(2, 30))) for _ in range(count)]
+
+corpora = {"synthetic": syntheticTexts, "recorded": recordedTexts}
+
+# A page of subpages x 20 rows of corpus text, with colour codes, a graphics run and a fastext row
+def corpusPage(texts, subpages, number=300):
+	page = {"number":number, "subpages":[]}
+	position = 0
+	for subcode in range(subpages):
+		packets = [{"number":1, "text":chr(20) + "`ppp0" + chr(7) + "Weer " + str(subcode + 1)}]
+		for row in range(3, 23):
+			packets.append({"number":row, "text":chr(1 + row % 7) + texts[position % len(texts)][:38]})
+			position += 1
+		packets.append({"number":24, "text":chr(1) + "Nieuws" + chr(2) + "Sport" + chr(3) + "Weer" + chr(6) + "Index"})
+		packets.append({"number":27, "linking":{"pages":["100", "200", "300", "400", "8ff", "100"]}})
+		page["subpages"].append({"packets":packets})
+	return page
+
+def paragraph(texts, words):
+	text = " ".join(texts)
+	return " ".join(text.split()[:words])
+
+# Each case yields (size, function to time); setup happens outside the timed function
+
+def caseCharsub(texts):
+	for length in (40, 200, 1000):
+		samples = [(" ".join(texts[i:]) + " " + " ".join(texts))[:length] for i in range(0, len(texts), max(1, len(texts) // 20))]
+		yield length, lambda samples=samples: [charsub(text) for text in samples]
+
+def casePageLegaliser(texts):
+	for subpages in sizes:
+		page = corpusPage(texts, subpages)
+		yield subpages, lambda page=page: pageLegaliser(page, fast=True)
+
+def casePageLegaliserCopy(texts):
+	for subpages in sizes:
+		page = corpusPage(texts, subpages)
+		yield subpages, lambda page=page: pageLegaliser(page)
+
+def caseWriteEnhancements(texts):
+	enhancementRows = {}
+	for row, text in enumerate(texts * 20):	# Recorded text has few diacritics, so go round more than once
+		legaliseText(text, enhancementRows.setdefault(2 + row % 21, []))
+		if sum(map(len, enhancementRows.values())) >= 194:
+			break
+	enhancements = coalesceEnhancements(enhancementRows)
+	for count in (13, 64, 194):	# 194 is the most that fits in 15 packets
+		if len(enhancements) >= count:
+			yield count, lambda enhancements=enhancements[:count]: write_enhancements(enhancements)
+
+def caseTextColour(texts):
+	for words in (10, 50, 200):
+		chunks = [{"colour":"yellow", "text":paragraph(texts, words)}]
+		yield words, lambda chunks=chunks: textColour(chunks, maxWidth=39)
+
+def caseToTeletextBlock(texts):
+	for words in (10, 50, 200):
+		block = {"content":[{"align":"left", "content":[{"colour":"white", "text":paragraph(texts, words)}]}]}
+		yield words, lambda block=block: toTeletextBlock(block, line=3)
+
+def caseToTeletextBlockCached(texts):
+	for words in (10, 50, 200):
+		block = {"content":[{"align":"left", "content":[{"colour":"white", "text":paragraph(texts, words)}]}]}
+		cache = LayoutCache()
+		yield words, lambda block=block, cache=cache: toTeletextBlock(block, line=3, cache=cache)
+
+tableFormat = [
+	{"width":20, "data":"name", "colour":"cyan"},
+	{"width":6, "data":"temperature", "colour":"yellow", "align":"right", "round":1},
+	{"width":10, "data":"description", "colour":"white"},
+]
+
+def tableData(texts, rows):
+	return [{"name":text[:24], "temperature":len(text) / 3, "description":text[-12:]} for text in (texts * rows)[:rows]]
+
+def caseTableRow(texts):
+	for rows in (10, 50, 200):
+		data = tableData(texts, rows)
+		yield rows, lambda data=data: [tableRow(tableFormat, row) for row in data]
+
+def caseTableFormatter(texts):
+	for rows in (10, 50, 200):
+		data = tableData(texts, rows)
+		yield rows, lambda data=data: TableFormatter(tableFormat).rows(data)
+
+def caseLoadTTI(texts, directory):
+	for subpages in sizes:
+		page = pageLegaliser(corpusPage(texts, subpages, 300 + subpages))
+		exportTTI(page, directory=directory)
+		filename = os.path.join(directory, "P" + str(300 + subpages) + ".tti")
+		yield subpages, lambda filename=filename: loadTTI(filename)
+
+def caseExportTTI(texts, directory):
+	for subpages in sizes:
+		page = pageLegaliser(corpusPage(texts, subpages, 400 + subpages))
+		yield subpages, lambda page=page: exportTTI(page, directory=directory)
+
+def caseExportTTIIncremental(texts, directory):
+	for subpages in sizes:
+		page = pageLegaliser(corpusPage(texts, subpages, 500 + subpages))
+		exportTTI(page, incremental=True, directory=directory)
+		yield subpages, lambda page=page: exportTTI(page, incremental=True, directory=directory)
+
+# teletextDeMinify expands the page it's given in place, so every timed call needs its own copy.
+# Only the page, subpage dicts and packet lists are copied, the packets themselves are shared
+def minifiedCopy(page):
+	copied = dict(page, subpages=[dict(subpage, packets=list(subpage["packets"])) for subpage in page["subpages"]])
+	if "packets" in page:
+		copied["packets"] = list(page["packets"])
+	return copied
+
+def caseDeMinify(texts):
+	for subpages in sizes:
+		page = corpusPage(texts, subpages)
+		for subpage in page["subpages"]:
+			subpage["inherit"] = True
+		page = teletextMinify(page)
+		yield subpages, lambda page=page: teletextDeMinify(minifiedCopy(page))
+
+def caseBlockOverlay(texts):
+	source = corpusPage(texts, 1)["subpages"][0]["packets"]
+	for rows in (1, 8, 20):
+		overlay = [{"number":row + 1, "text":texts[row % len(texts)][:20]} for row in range(rows)]
+		yield rows, lambda overlay=overlay, rows=rows: blockOverlay(source, overlay, 10, 3, 29, 2 + rows, "left")
+
+# Benchmark name -> (case, needs a scratch directory)
+cases = {
+	"charsub": (caseCharsub, False),
+	"pageLegaliser": (casePageLegaliser, False),
+	"pageLegaliser (copy)": (casePageLegaliserCopy, False),
+	"write_enhancements": (caseWriteEnhancements, False),
+	"textColour": (caseTextColour, False),
+	"toTeletextBlock": (caseToTeletextBlock, False),
+	"toTeletextBlock (cached)": (caseToTeletextBlockCached, False),
+	"tableRow": (caseTableRow, False),
+	"TableFormatter.rows": (caseTableFormatter, False),
+	"loadTTI": (caseLoadTTI, True),
+	"exportTTI": (caseExportTTI, True),
+	"exportTTI (incremental)": (caseExportTTIIncremental, True),
+	"teletextDeMinify": (caseDeMinify, False),
+	"blockOverlay": (caseBlockOverlay, False),
+}
+
+# Time one function: calibrate the loop count to at least minTime seconds, then take the best
+# and the median of repeat runs, in microseconds per call
+def measure(function, minTime=0.2, repeat=5):
+	timer = timeit.Timer(function)
+	single = max(timer.timeit(number=1), timer.timeit(number=1) if minTime else 0)	# The first call can be a cold one
+	number = max(1, int(minTime / max(single, 1e-7)))
+	times = [elapsed / number * 1e6 for elapsed in timer.repeat(repeat=repeat, number=number)]
+	return {"calls":number, "best_us":round(min(times), 3), "median_us":round(statistics.median(times), 3)}
+
+def gitCommit():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+	except OSError:
+		return None
+
+def runSuite(nameFilter=None, quick=False):
+	results = []
+	with tempfile.TemporaryDirectory() as directory:
+		for corpusName, loadCorpus in corpora.items():
+			texts = loadCorpus()
+			for name, (case, needsDirectory) in cases.items():
+				if nameFilter and nameFilter.lower() not in name.lower():
+					continue
+				for size, function in (case(texts, directory) if needsDirectory else case(texts)):
+					result = {"benchmark":name, "corpus":corpusName, "size":size}
+					result.update(measure(function, 0.05 if quick else 0.2, 3 if quick else 5))
+					results.append(result)
+					print("%-26s %-10s %6s %12.2f us" % (name, corpusName, size, result["best_us"]))
+	
+	return {
+		"meta":{
+			"commit":gitCommit(),
+			"time":time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"python":platform.python_version(),
+			"implementation":platform.python_implementation(),
+			"machine":platform.machine(),
+			"quick":quick,
+		},
+		"results":results,
+	}
+
+# Print the change against an earlier results file, matching on benchmark, corpus and size
+def compareResults(results, baseline):
+	before = {(result["benchmark"], result["corpus"], result["size"]):result for result in baseline["results"]}
+	print()
+	print("Compared to " + str(baseline["meta"].get("commit")) + " (best of runs, negative is faster):")
+	for result in results["results"]:
+		old = before.get((result["benchmark"], result["corpus"], result["size"]))
+		if old:
+			change = (result["best_us"] - old["best_us"]) / old["best_us"] * 100
+			print("%-26s %-10s %6s %12.2f -> %10.2f us  %+6.1f%%" % (result["benchmark"], result["corpus"], result["size"], old["best_us"], result["best_us"], change))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmarks for the CIMS render, legalise and TTI I/O paths")
+	parser.add_argument("--output", help="write the results to this JSON file")
+	parser.add_argument("--compare", help="compare against an earlier results file")
+	parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+	parser.add_argument("--quick", action="store_true", help="shorter runs, for a rough idea")
+	parser.add_argument("--legacy", action="store_true", help="also compare against the pre-optimisation implementations")
+	parser.add_argument("--check", action="store_true", help="only check the packet 26 encoder, then exit")
+	args = parser.parse_args()
+	
+	if args.check:
+		try:
+			checkEnhancements()
+		except CheckFailed as e:
+			sys.exit("checkEnhancements: " + str(e))
+		sys.exit()
+	
+	if args.legacy:
+		benchCharsub()
+		benchPageLegaliser()
+		checkEnhancements()
+		print()
+	
+	results = runSuite(args.filter, args.quick)
+	
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as f:
+			json.dump(results, f, indent=1)
+	
+	if args.compare:
+		with open(args.compare, encoding="utf-8") as f:
+			compareResults(results, json.load(f))
@@ -0,0 +1,383 @@
+# Client voor de buienradar JSON-feed
+# Houdt de verbinding open tussen verversingen, stuurt If-None-Match/If-Modified-Since mee
+# en slaat het downloaden en decoderen over als de feed niet veranderd is (304)
+# Met haal_selectie wordt alleen gedecodeerd wat op de pagina komt: de feed wordt in stukken gelezen,
+# stations die we niet zoeken en secties die we niet gebruiken worden overgeslagen
+
+import codecs
+import gzip
+import hashlib
+import json
+import re
+import time
+from publish import publishFile
+import metrics
+
+feed_url = "https://data.buienradar.nl/2.0/feed/json"
+
+# Secties naast de stations die weertekst gebruikt, als paden in de feed
+standaard_secties = (("forecast", "weatherreport"),)
+
+def normaliseer_naam(naam):
+    return naam.strip().lower()
+
+# Stations opzoeken op naam (hoofdletterongevoelig, met of zonder "Meetstation") of op stationid
+class StationIndex:
+    def __init__(self, stations):
+        self.stations = stations
+        self.op_naam = {}
+        self.op_id = {}
+        for station in stations:
+            naam = normaliseer_naam(station.get("stationname", ""))
+            self.op_naam[naam] = station
+            self.op_naam.setdefault(naam.removeprefix("meetstation "), station)
+            if "stationid" in station:
+                self.op_id[station["stationid"]] = station
+
+    def zoek(self, sleutel):
+        if isinstance(sleutel, int) or (isinstance(sleutel, str) and sleutel.strip().isdigit()):
+            return self.op_id.get(int(sleutel))
+        return self.op_naam.get(normaliseer_naam(sleutel))
+
+    def __len__(self):
+        return len(self.stations)
+
+witruimte = " \t\r\n"
+nietWit = re.compile(r"[ \t\r\n]*")
+overslaanTot = re.compile(r'[^\[\]{}"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^\[\]{}"]*)*')
+getalRest = re.compile(r"[0-9.eE+\-]*")
+decoder = json.JSONDecoder()
+
+# JSON lezen uit een reeks byte-stukken (zoals response.iter_content), zonder het hele document te decoderen.
+# Alleen wat met waarde() gelezen wordt, wordt een Python-object; de rest wordt met overslaan() alleen gescand
+class JsonStroom:
+    def __init__(self, stukken):
+        self.stukken = iter(stukken)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.einde = False
+
+    # Lees het volgende stuk in de buffer; wat al verwerkt is, wordt weggegooid. False aan het einde
+    def vul(self):
+        if self.einde:
+            return False
+        for stuk in self.stukken:
+            tekst = self.utf8.decode(stuk)
+            if tekst:
+                self.buffer = self.buffer[self.pos:] + tekst
+                self.pos = 0
+                return True
+        self.einde = True
+        self.buffer = self.buffer[self.pos:] + self.utf8.decode(b"", final=True)
+        self.pos = 0
+        return False
+
+    # Het volgende teken dat geen witruimte is, zonder het te verbruiken
+    def teken(self):
+        if self.pos < len(self.buffer) and self.buffer[self.pos] not in witruimte:
+            return self.buffer[self.pos]
+        while True:
+            self.pos = nietWit.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.vul():
+                raise ValueError("Onverwacht einde van de feed")
+
+    def verwacht(self, teken):
+        gevonden = self.teken()
+        if gevonden != teken:
+            raise ValueError("Verwacht " + repr(teken) + ", gevonden " + repr(gevonden))
+        self.pos += 1
+
+    # Decodeer de volgende waarde
+    def waarde(self):
+        self.teken()
+        while True:
+            try:
+                value, einde = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.vul():
+                    raise
+                continue
+            # Een getal aan het eind van de buffer kan nog doorlopen in het volgende stuk
+            if isinstance(value, (int, float)) and getalRest.match(self.buffer, einde).end() == len(self.buffer) and self.vul():
+                continue
+            self.pos = einde
+            return value
+
+    # Sla de volgende waarde over. Past die helemaal in de buffer, dan is de C-decoder het snelst;
+    # anders scannen we tot het bijbehorende haakje, zonder objecten te maken
+    def overslaan(self):
+        if self.teken() not in "{[":
+            self.waarde()
+            return
+
+        try:
+            self.pos = decoder.raw_decode(self.buffer, self.pos)[1]
+            return
+        except json.JSONDecodeError:
+            pass
+
+        diepte = 0
+        while True:
+            # Alles tot het volgende haakje in één keer, strings inbegrepen
+            self.pos = overslaanTot.match(self.buffer, self.pos).end()
+            if self.pos == len(self.buffer) or self.buffer[self.pos] == '"':  # String loopt door in het volgende stuk
+                if not self.vul():
+                    raise ValueError("Onverwacht einde van de feed")
+                continue
+            diepte += 1 if self.buffer[self.pos] in "{[" else -1
+            self.pos += 1
+            if diepte == 0:
+                return
+
+    # Loop over de sleutels van een object; na elke sleutel moet de aanroeper de waarde lezen of overslaan
+    def sleutels(self):
+        self.verwacht("{")
+        if self.teken() == "}":
+            self.pos += 1
+            return
+        while True:
+            sleutel = self.waarde()
+            self.verwacht(":")
+            yield sleutel
+            teken = self.teken()
+            self.pos += 1
+            if teken == "}":
+                return
+            if teken != ",":
+                raise ValueError("Verwacht ',' of '}', gevonden " + repr(teken))
+
+    # Loop over de elementen van een array; na elke stap moet de aanroeper het element lezen of overslaan
+    def elementen(self):
+        self.verwacht("[")
+        if self.teken() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            teken = self.teken()
+            self.pos += 1
+            if teken == "]":
+                return
+            if teken != ",":
+                raise ValueError("Verwacht ',' of ']', gevonden " + repr(teken))
+
+class Klaar(Exception):
+    pass
+
+# Lees een object volgens een selectie: per sleutel True (hele waarde), een geneste selectie,
+# of een StationFilter voor een array. Al het andere wordt overgeslagen
+def lees_object(stroom, selectie, open_paden, uitvoer):
+    for sleutel in stroom.sleutels():
+        keuze = selectie.get(sleutel)
+        if keuze is None:
+            stroom.overslaan()
+        elif keuze is True:
+            uitvoer[sleutel] = stroom.waarde()
+            open_paden[0] -= 1
+        elif isinstance(keuze, dict):
+            lees_object(stroom, keuze, open_paden, uitvoer.setdefault(sleutel, {}))
+        else:
+            lijst = uitvoer.setdefault(sleutel, [])
+            for _ in stroom.elementen():
+                if keuze.compleet():
+                    stroom.overslaan()  # Alle stations gevonden, de rest alleen nog scannen
+                    continue
+                station = stroom.waarde()  # Eén station tegelijk; wat niet past, is meteen weer weg
+                if keuze.past(station):
+                    lijst.append(station)
+            open_paden[0] -= 1
+        if open_paden[0] == 0:
+            raise Klaar  # Alles gevonden; de rest van de feed hoeft niet gelezen te worden
+
+# Houdt bij welke stations (op naam of stationid) we nog zoeken. Zonder stations worden ze allemaal gehouden
+class StationFilter:
+    def __init__(self, stations=None):
+        self.alles = stations is None
+        self.namen = set()  # Zonder "meetstation " ervoor, zodat "Schiphol" en "Meetstation Schiphol" hetzelfde zijn
+        self.ids = set()
+        for sleutel in stations or ():
+            if isinstance(sleutel, int) or sleutel.strip().isdigit():
+                self.ids.add(int(sleutel))
+            else:
+                self.namen.add(normaliseer_naam(sleutel).removeprefix("meetstation "))
+        # Nog niet gevonden. Eén station kan meer dan één sleutel afdekken, bijvoorbeeld zijn naam en zijn stationid
+        self.open_namen = set(self.namen)
+        self.open_ids = set(self.ids)
+
+    def past(self, station):
+        if self.alles:
+            return True
+        naam = normaliseer_naam(station.get("stationname", "")).removeprefix("meetstation ")
+        stationid = station.get("stationid")
+        if naam in self.namen or stationid in self.ids:
+            self.open_namen.discard(naam)
+            self.open_ids.discard(stationid)
+            return True
+        return False
+
+    def compleet(self):
+        return not self.alles and not self.open_namen and not self.open_ids
+
+# Haal de gevraagde stations en secties uit een JSON-feed in byte-stukken.
+# stations: namen of stationid's (None: alle stations), secties: paden zoals ("forecast", "weatherreport")
+def extraheer(stukken, stations=None, secties=standaard_secties):
+    selectie = {"actual": {"stationmeasurements": StationFilter(stations)}}
+    for pad in secties:
+        niveau = selectie
+        for sleutel in pad[:-1]:
+            niveau = niveau.setdefault(sleutel, {})
+        niveau[pad[-1]] = True
+
+    uitvoer = {}
+    open_paden = [1 + len(secties)]
+    try:
+        lees_object(JsonStroom(stukken), selectie, open_paden, uitvoer)
+    except Klaar:
+        pass
+    return uitvoer
+
+class FeedClient:
+    def __init__(self, url=feed_url, timeout=(3.05, 10), pool_size=4):
+        self.url = url
+        self.timeout = timeout  # (verbinden, lezen) in seconden
+        self.pool_size = pool_size
+        self.session = None
+        self.etag = None
+        self.last_modified = None
+        self.data = None  # Laatst ontvangen feed
+        self.index = None  # StationIndex bij self.data, als die met haal_selectie is opgehaald
+
+    # Eén sessie met connection pooling, pas aangemaakt bij de eerste aanvraag
+    def sessie(self):
+        if self.session is None:
+            import requests  # Pas laden als we echt iets gaan ophalen
+            from requests.adapters import HTTPAdapter
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def conditionele_headers(self):
+        headers = {"Accept-Encoding": "gzip", "Accept": "application/json"}
+        if self.data is not None:  # Alleen zinvol als we de vorige versie nog hebben
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    # Haal de feed op als die veranderd is. Geeft (response, veranderd) terug;
+    # bij een 304 is response None en blijft self.data de vorige feed
+    def haal_response_op(self, stream=False):
+        response = self.sessie().get(self.url, headers=self.conditionele_headers(), timeout=self.timeout, stream=stream)
+
+        if response.status_code == 304:
+            self.geef_terug(response)
+            return None, False
+
+        response.raise_for_status()
+        return response, True
+
+    # Lees de rest van de body ongedecodeerd weg en geef de verbinding terug aan de pool. Een response die
+    # niet helemaal gelezen is, sluit urllib3 bij close(), en dan kost de volgende aanvraag een nieuwe TCP/TLS-verbinding
+    @staticmethod
+    def geef_terug(response):
+        response.raw.drain_conn()
+        response.raw.release_conn()
+        response.close()
+
+    def onthoud_validators(self, response):
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+
+    # Haal de volledige feed op. Geeft (data, veranderd) terug
+    def haal_op(self):
+        with metrics.stage("fetch"):
+            response, veranderd = self.haal_response_op()
+        if not veranderd:
+            metrics.count("feed_not_modified")
+            return self.data, False
+
+        with metrics.stage("decode"):
+            data = response.json()
+        self.onthoud_validators(response)  # Pas na een geslaagde decode, anders krijgen we kapotte data nooit opnieuw
+        self.data = data
+        return data, True
+
+    # Haal alleen de gevraagde stations (namen of stationid's) en secties op, al lezend uit de response.
+    # Geeft (data, veranderd) terug; data heeft dezelfde vorm als de volledige feed, en self.index
+    # is een StationIndex over de gevonden stations
+    def haal_selectie(self, stations=None, secties=standaard_secties):
+        with metrics.stage("fetch"):  # Tot en met de headers; de body wordt gelezen terwijl we decoderen
+            response, veranderd = self.haal_response_op(stream=True)
+        if not veranderd:
+            metrics.count("feed_not_modified")
+            return self.data, False
+
+        try:
+            with metrics.stage("decode"):
+                data = extraheer(response.iter_content(chunk_size=16384), stations, secties)
+            # Zijn we vroeg klaar, dan wordt de rest van de body alleen nog weggelezen
+            with metrics.stage("fetch"):
+                self.geef_terug(response)
+        finally:
+            response.close()  # Na een fout sluiten we de verbinding wel
+
+        if "stationmeasurements" not in data.get("actual", {}):
+            raise ValueError("Geen actual.stationmeasurements in de feed")
+
+        self.onthoud_validators(response)
+        self.data = data
+        self.index = StationIndex(data.get("actual", {}).get("stationmeasurements", []))
+        return data, True
+
+    # Begin met een eerder opgeslagen feed, zodat de eerste aanvraag na een herstart al een 304 kan krijgen
+    def herstel(self, ingang):
+        self.data = ingang["data"]
+        self.index = StationIndex(self.data.get("actual", {}).get("stationmeasurements", []))
+        self.etag = ingang.get("etag")
+        self.last_modified = ingang.get("last_modified")
+
+    def sluit(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+# De laatste goede feed op schijf: één regel JSON met metadata en een checksum, daarna de feed als gzip
+# Een ingang is een dict met data, opgehaald (wanneer de data voor het laatst veranderde),
+# gevalideerd (wanneer de server dat voor het laatst bevestigde), etag en last_modified
+class FeedCache:
+    versie = 1
+
+    def __init__(self, bestand, ttl=60):
+        self.bestand = bestand
+        self.ttl = ttl
+
+    # Lees de cache. None als die er niet is, kapot is, of voor een andere selectie stations is
+    def laad(self, selectie=None):
+        try:
+            with open(self.bestand, "rb") as f:
+                kop = json.loads(f.readline())
+                inhoud = f.read()
+            if kop.get("versie") != self.versie or kop.get("selectie") != selectie:
+                return None
+            if hashlib.blake2b(inhoud, digest_size=16).hexdigest() != kop.get("checksum"):
+                return None
+            ingang = {sleutel: kop.get(sleutel) for sleutel in ("opgehaald", "gevalideerd", "etag", "last_modified")}
+            ingang["data"] = json.loads(gzip.decompress(inhoud))
+            return ingang
+        except (OSError, ValueError, EOFError):
+            return None
+
+    def bewaar(self, ingang, selectie=None):
+        inhoud = gzip.compress(json.dumps(ingang["data"], separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 6)
+        kop = {sleutel: ingang.get(sleutel) for sleutel in ("opgehaald", "gevalideerd", "etag", "last_modified")}
+        kop.update(versie=self.versie, selectie=selectie, checksum=hashlib.blake2b(inhoud, digest_size=16).hexdigest())
+        publishFile(self.bestand, json.dumps(kop).encode("utf-8") + b"\n" + inhoud)
+
+    def vers(self, ingang, nu=None):
+        return ((nu or time.time()) - ingang["gevalideerd"]) < self.ttl
@@ -0,0 +1,95 @@
+# Lokale vervanger van de buienradar-server, om FeedClient en weertekst offline te testen
+# Speelt opgenomen feeds uit een map af (op alfabetische volgorde, elke --wissel seconden de volgende),
+# met ETag, Last-Modified, 304-antwoorden en gzip, net als de echte server
+#
+# Gebruik: python feedreplay.py feeds/ --port 8000
+#          python weertekst.py --url http://localhost:8000/
+
+import argparse
+import email.utils
+import gzip
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Opnames:
+    def __init__(self, map, wissel=600):
+        self.bestanden = sorted(os.path.join(map, naam) for naam in os.listdir(map) if naam.endswith(".json"))
+        if not self.bestanden:
+            raise ValueError("Geen .json-bestanden in " + map)
+        self.wissel = wissel
+        self.start = time.time()
+        self.cache = {}
+
+    # De opname die nu "live" is, als (body, etag, last_modified)
+    def huidige(self):
+        index = int((time.time() - self.start) // self.wissel) % len(self.bestanden) if self.wissel > 0 else 0
+        bestand = self.bestanden[index]
+        if bestand not in self.cache:
+            with open(bestand, "rb") as f:
+                body = f.read()
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            last_modified = email.utils.formatdate(self.start + index * self.wissel, usegmt=True)
+            self.cache[bestand] = (body, etag, last_modified)
+        return self.cache[bestand]
+
+def maak_handler(opnames):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, zodat de connection pool van FeedClient echt gebruikt wordt
+
+        def do_GET(self):
+            body, etag, last_modified = opnames.huidige()
+
+            if self.headers.get("If-None-Match") == etag or (self.headers.get("If-None-Match") is None and self.headers.get("If-Modified-Since") == last_modified):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body)
+                gezipt = True
+            else:
+                gezipt = False
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            if gezipt:
+                self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Stil, tenzij er iets misgaat
+
+    return Handler
+
+# Start een replay-server op de achtergrond. Geeft de server terug; stop hem met server.shutdown()
+def start_server(map, port=0, wissel=600):
+    server = ThreadingHTTPServer(("127.0.0.1", port), maak_handler(Opnames(map, wissel)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Speel opgenomen buienradar-feeds af over HTTP")
+    parser.add_argument("map", help="map met opgenomen feeds (.json)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--wissel", type=float, default=600, help="seconden per opname (0: altijd de eerste)")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), maak_handler(Opnames(args.map, args.wissel)))
+    print("Feeds uit " + args.map + " op http://127.0.0.1:" + str(server.server_address[1]) + "/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+     #########  ##############  #######
+    ##     ##  ##    ##    ##  ##
+   ##     ##  ##    ##    ##  #######
+  ##     ##  ##    ##    ##       ##
+ ##     ##  ##    ##    ##  #######
+
+# Compact page model for CIMS
+# Rows 0-24 of each subpage live in one 25x40 bytearray, with O(1) access by row number,
+# instead of a list of {"number":..,"text":..} dicts. Use toFrame and fromFrame to convert
+# to and from the standard teletext object.
+
+from page import teletextDeMinify
+
+rowCount = 25
+rowWidth = 40
+absent = 0xff	# Length marker for rows that aren't on the page at all
+
+class SubpageFrame:
+	__slots__ = ("grid", "lengths", "overflow", "extra", "subcode", "control", "inherit", "attributes")
+
+	def __init__(self):
+		self.grid = bytearray(b" " * (rowCount * rowWidth))
+		self.lengths = bytearray([absent]) * rowCount	# Text length of each row, so trailing spaces survive the round trip
+		self.overflow = {}	# Rows 0-24 that don't fit in the grid (longer than 40, or not 8 bit)
+		self.extra = []	# Every other packet (26, 27, duplicate rows...) as-is
+		self.subcode = None
+		self.control = None
+		self.inherit = None
+		self.attributes = None	# Any other subpage keys
+
+	# Text of a row, or None if the subpage doesn't have it
+	def row(self, number):
+		length = self.lengths[number]
+		if length == absent:
+			return self.overflow.get(number)
+		start = number * rowWidth
+		return self.grid[start:start + length].decode("latin-1")
+
+	def setRow(self, number, text):
+		start = number * rowWidth
+		try:
+			encoded = text.encode("latin-1")
+		except UnicodeEncodeError:
+			encoded = None
+
+		if encoded is None or len(encoded) > rowWidth:
+			self.clearRow(number)
+			self.overflow[number] = text
+			return
+
+		self.overflow.pop(number, None)
+		self.grid[start:start + rowWidth] = encoded.ljust(rowWidth)
+		self.lengths[number] = len(encoded)
+
+	def clearRow(self, number):
+		start = number * rowWidth
+		self.grid[start:start + rowWidth] = b" " * rowWidth
+		self.lengths[number] = absent
+		self.overflow.pop(number, None)
+
+	def hasRow(self, number):
+		return self.lengths[number] != absent or number in self.overflow
+
+	# Packets in the standard dict form, sorted by row number
+	def packets(self):
+		output = [{"number":number, "text":self.row(number)} for number in range(rowCount) if self.hasRow(number)]
+		output += self.extra
+		return sorted(output, key=lambda d: d['number'])
+
+class PageFrame:
+	__slots__ = ("number", "subpages", "attributes")
+
+	def __init__(self, number=None):
+		self.number = number
+		self.subpages = []
+		self.attributes = None	# Any other page keys
+
+# Convert a standard teletext object into a PageFrame. The page is de-minified on the way,
+# without modifying the object passed in.
+def toFrame(page):
+	page = dict(page, subpages=[dict(subpage, packets=list(subpage.get("packets", []))) for subpage in page.get("subpages", [])])
+	page = teletextDeMinify(page)
+
+	output = PageFrame(page.get("number"))
+	others = {key:value for key, value in page.items() if key not in ("number", "subpages")}
+	if others:
+		output.attributes = others
+
+	for subpage in page["subpages"]:
+		subpageFrame = SubpageFrame()
+		subpageFrame.subcode = subpage.get("subcode")
+		subpageFrame.control = subpage.get("control")
+		subpageFrame.inherit = subpage.get("inherit")
+
+		others = {key:value for key, value in subpage.items() if key not in ("packets", "subcode", "control", "inherit")}
+		if others:
+			subpageFrame.attributes = others
+
+		for packet in subpage["packets"]:
+			number = packet["number"]
+			if 0 <= number < rowCount and packet.keys() == {"number", "text"} and not subpageFrame.hasRow(number):
+				subpageFrame.setRow(number, packet["text"])
+			else:
+				subpageFrame.extra.append(packet)
+
+		output.subpages.append(subpageFrame)
+
+	return output
+
+# Convert a PageFrame back into a standard (de-minified) teletext object
+def fromFrame(frame):
+	output = {}
+	if frame.number is not None:
+		output["number"] = frame.number
+	if frame.attributes:
+		output.update(frame.attributes)
+
+	output["subpages"] = []
+	for subpageFrame in frame.subpages:
+		subpage = {}
+		if subpageFrame.attributes:
+			subpage.update(subpageFrame.attributes)
+		if subpageFrame.subcode is not None:
+			subpage["subcode"] = subpageFrame.subcode
+		if subpageFrame.control is not None:
+			subpage["control"] = subpageFrame.control
+		if subpageFrame.inherit is not None:
+			subpage["inherit"] = subpageFrame.inherit
+		subpage["packets"] = subpageFrame.packets()
+		output["subpages"].append(subpage)
+
+	return output
@@ -1,103 +1,121 @@
 from page import teletextDeMinify
 import copy, re
+import metrics
 
-def charsub(text):
-	if type(text) is not str:
-		print("legaliser tried to charsub something that's not text!")
-		return text
-	
-	text = re.sub("^\s+|\s+$|\s+(?=\s)","",text)	# Remove extraneous whitespace
-	
+# Character substitutions applied by charsub(), in the order they used to be applied
+# Keys longer than one character are handled by a regex, everything else goes through str.translate
+substitutions = {
 	# do any substitutitons that will change the length of the text
-	#text = text.replace("­", "") # strip soft hyphens as wrapping text is hard enough already   -- Uh, no? Kinda necessary for our purposes
-	text = text.replace("…", "...")
-	text = text.replace("&lt;", "<")
-	text = text.replace("&gt;", ">")
-	text = text.replace("&amp;", "&")
-	text = text.replace(" ", " ") # Non-line-breaking space
-	text = text.replace("\r\n", " ")
-	text = text.replace("\r", " ")
+	#"­":"", # strip soft hyphens as wrapping text is hard enough already   -- Uh, no? Kinda necessary for our purposes
+	"…":"...",
+	"&lt;":"<",
+	"&gt;":">",
+	"&amp;":"&",
+	" ":" ", # Non-line-breaking space
+	"\r\n":" ",
+	"\r":" ",
 
 	# digraphs and ligatures
-	text = text.replace("Ǳ", "DZ")
-	text = text.replace("ǲ", "Dz")
-	text = text.replace("ǳ", "dz")
-	text = text.replace("Ǆ", "DŽ")
-	text = text.replace("ǅ", "Dž")
-	text = text.replace("ǆ", "dž")
-	#text = text.replace("Ĳ", "IJ") # supported in Latin G2
-	#text = text.replace("ĳ", "ij") # supported in Latin G2
-	text = text.replace("Ǉ", "LJ")
-	text = text.replace("ǈ", "Lj")
-	text = text.replace("ǉ", "lj")
-	text = text.replace("Ǌ", "NJ")
-	text = text.replace("ǋ", "Nj")
-	text = text.replace("ǌ", "nj")
-	text = text.replace("ᵺ", "th")
-	text = text.replace("Ꜳ", "AA")
-	text = text.replace("ꜳ", "aa")
-	#text = text.replace("Æ", "AE") # supported in Latin G2
-	#text = text.replace("æ", "ae") # supported in Latin G2
-	text = text.replace("Ꜵ", "AO")
-	text = text.replace("ꜵ", "ao")
-	text = text.replace("Ꜷ", "AU")
-	text = text.replace("ꜷ", "au")
-	text = text.replace("Ꜹ", "AV")
-	text = text.replace("ꜹ", "av")
-	text = text.replace("Ꜻ", "AV")
-	text = text.replace("ꜻ", "av")
-	text = text.replace("Ꜽ", "AY")
-	text = text.replace("ꜽ", "ay")
-	text = text.replace("🙰", "et")
-	text = text.replace("ﬀ", "ff")
-	text = text.replace("ﬃ", "ffi")
-	text = text.replace("ﬄ", "ffl")
-	text = text.replace("ﬁ", "fi")
-	text = text.replace("ﬂ", "fl")
-	text = text.replace("Ƕ", "Hv")
-	text = text.replace("ƕ", "hv")
-	text = text.replace("℔", "lb")
-	text = text.replace("Ỻ", "lL")
-	text = text.replace("ỻ", "ll")
-	#text = text.replace("Œ", "OE") # supported in Latin G2
-	#text = text.replace("œ", "oe") # supported in Latin G2
-	text = text.replace("Ꝏ", "OO")
-	text = text.replace("ꝏ", "oo")
-	text = text.replace("ﬆ", "st")
-	text = text.replace("ﬅ", "ft")
-	text = text.replace("Ꜩ", "TZ")
-	text = text.replace("ꜩ", "tz")
-	text = text.replace("ᵫ", "ue")
-	text = text.replace("ꭣ", "uo")
-	text = text.replace("Ꝡ", "VY")
-	text = text.replace("ꝡ", "vy")
+	"Ǳ":"DZ",
+	"ǲ":"Dz",
+	"ǳ":"dz",
+	"Ǆ":"DŽ",
+	"ǅ":"Dž",
+	"ǆ":"dž",
+	#"Ĳ":"IJ", # supported in Latin G2
+	#"ĳ":"ij", # supported in Latin G2
+	"Ǉ":"LJ",
+	"ǈ":"Lj",
+	"ǉ":"lj",
+	"Ǌ":"NJ",
+	"ǋ":"Nj",
+	"ǌ":"nj",
+	"ᵺ":"th",
+	"Ꜳ":"AA",
+	"ꜳ":"aa",
+	#"Æ":"AE", # supported in Latin G2
+	#"æ":"ae", # supported in Latin G2
+	"Ꜵ":"AO",
+	"ꜵ":"ao",
+	"Ꜷ":"AU",
+	"ꜷ":"au",
+	"Ꜹ":"AV",
+	"ꜹ":"av",
+	"Ꜻ":"AV",
+	"ꜻ":"av",
+	"Ꜽ":"AY",
+	"ꜽ":"ay",
+	"🙰":"et",
+	"ﬀ":"ff",
+	"ﬃ":"ffi",
+	"ﬄ":"ffl",
+	"ﬁ":"fi",
+	"ﬂ":"fl",
+	"Ƕ":"Hv",
+	"ƕ":"hv",
+	"℔":"lb",
+	"Ỻ":"lL",
+	"ỻ":"ll",
+	#"Œ":"OE", # supported in Latin G2
+	#"œ":"oe", # supported in Latin G2
+	"Ꝏ":"OO",
+	"ꝏ":"oo",
+	"ﬆ":"st",
+	"ﬅ":"ft",
+	"Ꜩ":"TZ",
+	"ꜩ":"tz",
+	"ᵫ":"ue",
+	"ꭣ":"uo",
+	"Ꝡ":"VY",
+	"ꝡ":"vy",
 
 	# map similar characters to one canonical unicode point
-	text = text.replace("€", "₠")
-	text = re.sub("[··᛫‧∙⋅⋅⸱⸳・ꞏ]","·",text,flags=re.UNICODE)
-	text = text.replace("•", "●")
-	text = text.replace("Ș", "Ş")
-	text = text.replace("ș", "ş")
-	text = text.replace("Å", "Å")
-	text = text.replace("„", "”")
-	text = text.replace("‟", "“")
-	text = text.replace("‘", "'")
-	text = text.replace("’", "'")
-	text = re.sub("[‒–—]","―",text,flags=re.UNICODE) # dashes to horizontal bar
+	"€":"₠",
+	**dict.fromkeys("··᛫‧∙⋅⋅⸱⸳・ꞏ","·"),
+	"•":"●",
+	"Ș":"Ş",
+	"ș":"ş",
+	"Å":"Å",
+	"„":"”",
+	"‟":"“",
+	"‘":"'",
+	"’":"'",
+	**dict.fromkeys("‒–—","―"), # dashes to horizontal bar
 
 	# emoji stuff
-	text = re.sub("[😊☺]","🙂",text,flags=re.UNICODE) # like slightly smiling face
-	text = re.sub("[😁😃😄😆]","😀",text,flags=re.UNICODE) # like grinning face
-	text = text.replace("😝", "😛") # face with tongue
-	text = text.replace("🤣", "😂") # rofl -> face with tears of joy
-	text = text.replace("🤓", "😎") # nerd -> sunglasses
-	text = re.sub("[☹😦]","🙁",text,flags=re.UNICODE) # like slightly frowning face
-	text = re.sub("[😭😥]", "😢",text,flags=re.UNICODE) # like crying face
-	text = re.sub("[🤚👋🖐]","✋",text,flags=re.UNICODE) # like raised hand
-	text = re.sub("[♡♥🎔💓💖💗💘💙💚💛💜💝💟🖤🧡]","❤",text,flags=re.UNICODE) # like heavy black heart
-	text = re.sub("["u"\U0000FE00-\U0000FE0F]","",text,flags=re.UNICODE) # strip variation selectors
-
-	return text
+	**dict.fromkeys("😊☺","🙂"), # like slightly smiling face
+	**dict.fromkeys("😁😃😄😆","😀"), # like grinning face
+	"😝":"😛", # face with tongue
+	"🤣":"😂", # rofl -> face with tears of joy
+	"🤓":"😎", # nerd -> sunglasses
+	**dict.fromkeys("☹😦","🙁"), # like slightly frowning face
+	**dict.fromkeys("😭😥","😢"), # like crying face
+	**dict.fromkeys("🤚👋🖐","✋"), # like raised hand
+	**dict.fromkeys("♡♥🎔💓💖💗💘💙💚💛💜💝💟🖤🧡","❤"), # like heavy black heart
+	**dict.fromkeys([chr(c) for c in range(0xFE00,0xFE10)],""), # strip variation selectors
+}
+
+# Build the substitution engine once at import. None of the replacement strings contain
+# a key of a later substitution, so doing everything in a single pass gives the same
+# result as the old chain of str.replace/re.sub calls.
+whitespacePattern = re.compile(r"^\s+|\s+$|\s+(?=\s)")	# Remove extraneous whitespace
+multiCharSubstitutions = {key:value for key,value in substitutions.items() if len(key) > 1}
+multiCharPattern = re.compile("|".join(re.escape(key) for key in sorted(multiCharSubstitutions, key=len, reverse=True)))
+multiCharLeaders = frozenset(key[0] for key in multiCharSubstitutions)
+charTable = str.maketrans({key:value for key,value in substitutions.items() if len(key) == 1})
+
+def charsub(text):
+	if type(text) is not str:
+		print("legaliser tried to charsub something that's not text!")
+		return text
+	
+	text = whitespacePattern.sub("",text)
+	
+	# Only run the regex when the text could contain one of the longer keys (entities, mostly)
+	if not multiCharLeaders.isdisjoint(text):
+		text = multiCharPattern.sub(lambda m: multiCharSubstitutions[m.group()],text)
+	
+	return text.translate(charTable)
 
 enhancementmapping = {
 	# map to L1 replacement character, enhancement mode, enhancement data
@@ -273,69 +291,130 @@ enhancementmapping = {
 	#todo: more mappings
 }
 
+terminator = chr(0x7f)+chr(0x7f)+chr(0x7f)	# Termination marker triplet (address 63, mode 31)
+
 def write_enhancements(enhancements):
+	if not enhancements:
+		return []
+	
+	# up to 15 enhancement packets per subpage, of up to 13 triplets each
+	# always leave room for at least one termination marker, so a full last packet is still terminated
+	if len(enhancements) > 15*13-1:
+		print("write_enhancements: " + str(len(enhancements) - (15*13-1)) + " enhancement triplets didn't fit and were dropped")
+		metrics.count("enhancement_triplets_dropped", len(enhancements) - (15*13-1))
+		enhancements = enhancements[:15*13-1]
+	
+	metrics.count("enhancement_triplets", len(enhancements))
+	
+	triplets = []
+	for enhancement in enhancements:
+		# combine parts of enhancement data into an 18 byte triplet, then slice it up into three 6 byte values to write to the row with bit 6 set
+		triplet = enhancement[0] | (enhancement[1] << 6) | (enhancement[2] << 11)
+		triplets.append(chr(0x40+(triplet&0x3F))+chr(0x40+((triplet>>6)&0x3F))+chr(0x40+((triplet>>12)&0x3F)))
+	
+	triplets.append(terminator)
+	triplets += [terminator] * (-len(triplets) % 13)	# Pad the last packet out with more terminators
+	
 	packets = []
-	for p in range(15): # up to 15 enhancement packets per subpage
-		packet = chr(0x40 + p) # first byte is designation code
-		for e in range(13): # up to 13 triplets per enhancement packet
-			if len(enhancements) > p*13+e:
-				# combine parts of enhancement data into an 18 byte triplet, then slice it up into three 6 byte values to write to the row with bit 6 set
-				triplet = enhancements[p*13+e][0] | ((enhancements[p*13+e][1]) << 6) | ((enhancements[p*13+e][2]) << 11)
-				packet+=chr(0x40+(triplet&0x3F))+chr(0x40+((triplet>>6)&0x3F))+chr(0x40+((triplet>>12)&0x3F))
-			elif e == 0:
-				# TODO: generate packet of terminators if previous packet is full.
-				return packets
-			else:
-				packet+=chr(0x7f)+chr(0x7f)+chr(0x7f)
-		packets.append(packet)
+	for p in range(len(triplets) // 13):
+		packets.append(chr(0x40 + p) + "".join(triplets[p*13:(p+1)*13]))	# first byte is designation code
 	
 	return packets
 
-def pageLegaliser(inpage):
-	page = copy.deepcopy(inpage)
+# Turn a {row: [[column, mode, data], ...]} dict into a triplet list, with one
+# row address triplet per row followed by that row's column triplets in order
+# Only rows 1-24 have a row address; enhancements for any other row are dropped
+def coalesceEnhancements(enhancementRows):
+	enhancements = []
+	
+	for row in sorted(enhancementRows):
+		if not enhancementRows[row]:
+			continue
+		
+		if not 1 <= row <= 24:
+			print("coalesceEnhancements: row " + str(row) + " has no row address, " + str(len(enhancementRows[row])) + " enhancement triplets were dropped")
+			metrics.count("enhancement_triplets_dropped", len(enhancementRows[row]))
+			continue
+		
+		enhancements.append([40 if row == 24 else row+40,4,0])	# Row 24 is address 40, rows 1-23 are 41-63
+		enhancements += sorted(enhancementRows[row])
+	
+	return enhancements
+
+# Lookup tables for pageLegaliser, built once from enhancementmapping
+# Codepoint -> level 1 codepoint, for use with str.translate
+class legalTranslation(dict):
+	# Anything above 7 bits that we don't have a mapping for becomes 0x7f
+	def __missing__(self, codepoint):
+		if codepoint > 127:
+			self[codepoint] = 0x7f
+			return 0x7f
+		raise LookupError(codepoint)
+
+legalTable = legalTranslation({codepoint:codepoint for codepoint in range(128)})	# 7 bit characters pass through unless mapped below
+legalTable.update({ord(character):(0x7f if mapping[0] > 127 else mapping[0]) for character, mapping in enhancementmapping.items()})
+
+# Character -> (enhancement mode, enhancement data), only for characters that need a packet 26 enhancement
+enhancementTable = {character:(mapping[1],mapping[2]) for character, mapping in enhancementmapping.items() if mapping[1] and mapping[0] <= 127}
+enhancementPattern = re.compile("[" + "".join(re.escape(character) for character in enhancementTable) + "]")
+
+# Graphics mode runs from a mosaic colour code (0x11-0x17) up to the next alpha colour code (0x00-0x07)
+graphicsPattern = re.compile("[\x11-\x17][^\x00-\x07]*")
+
+# Legalise one alphanumeric run of a row, starting at column offset
+# Column triplets for any enhanced characters are added to enhancements
+def legaliseRun(run, offset, enhancements):
+	for match in enhancementPattern.finditer(run):
+		mode, data = enhancementTable[match.group()]
+		enhancements.append([offset+match.start(),mode,data])
+	
+	return run.translate(legalTable)
+
+# Legalise a whole row, leaving graphics runs alone
+def legaliseText(text, enhancements):
+	output = []
+	position = 0
+	
+	for match in graphicsPattern.finditer(text):
+		if match.start() > position:
+			output.append(legaliseRun(text[position:match.start()], position, enhancements))
+		output.append(match.group())
+		position = match.end()
+	
+	if position < len(text):
+		output.append(legaliseRun(text[position:], position, enhancements))
+	
+	return "".join(output).rstrip()	# Remove trailing whitespace
+
+# Legalise a page for level 1 decoders, moving anything they can't display into packet 26 enhancements
+# With fast=True the input page isn't deep copied: unchanged packets are shared with the input,
+# so don't modify packets of the returned page in place.
+def pageLegaliser(inpage, fast=False):
+	if fast:
+		page = {key:value for key, value in inpage.items() if key != "subpages"}
+		if "packets" in page:
+			page["packets"] = list(page["packets"])
+		if "subpages" in inpage:
+			page["subpages"] = [dict(subpage, packets=list(subpage.get("packets",[]))) for subpage in inpage["subpages"]]
+	else:
+		page = copy.deepcopy(inpage)
+	
 	page = teletextDeMinify(page)
 	for subcode, subpage in enumerate(page["subpages"]):
-		enhancements = []
+		enhancementRows = {}
 		
 		subpage["packets"] = sorted(subpage["packets"], key=lambda d: d['number'])
 		
-		#print(subpage["packets"])
-		#print(sorted(subpage["packets"], key=lambda d: d['number']))
-		
-		#print("")
-		
 		for pNum,packet in enumerate(subpage["packets"]):
 			if "text" not in packet:
 				continue
 			
-			graphics = False
-			newLine = ""
-			
-			for position, character in enumerate(packet["text"]):
-				
-				if ord(character) >= 0x11 and ord(character) <= 0x17:
-					graphics = True
-				elif ord(character) >= 0x00 and ord(character) <= 0x07:
-					graphics = False
-				
-				if graphics == False:
-					safeChar = enhancementmapping.get(character, [ord(character),0,0])
-					if safeChar[0] > 127:
-						safeChar = [0x7f,0,0]
-					
-					if safeChar[1]:
-						enhancements.append([packet["number"]+40,4,0])
-						enhancements.append([position,safeChar[1],safeChar[2]])
-					
-					newLine += chr(safeChar[0])
-				else:
-					newLine += character
-			
-			newLine = newLine.rstrip()	# Remove trailing whitespace
+			newLine = legaliseText(packet["text"], enhancementRows.setdefault(packet["number"],[]))
 			
-			page["subpages"][subcode]["packets"][pNum]["text"] = newLine
+			if newLine != packet["text"]:
+				subpage["packets"][pNum] = dict(packet, text=newLine)
 		
-		for enhancementPacket in write_enhancements(enhancements):
-			page["subpages"][subcode]["packets"].append({"number":26,"text":enhancementPacket})
+		for enhancementPacket in write_enhancements(coalesceEnhancements(enhancementRows)):
+			subpage["packets"].append({"number":26,"text":enhancementPacket})
 	
 	return page
\ No newline at end of file
@@ -0,0 +1,92 @@
+# Meetwaarden van alle stations als kolommen (NumPy-arrays), met NaN voor wat ontbreekt
+# Afgeleide waarden (km/u, Beaufort, kompasrichting, gevoelstemperatuur, dauwpunt) worden in één keer
+# voor alle stations berekend, voor overzichtspagina's zoals "warmste/koudste nu"
+
+import numpy as np
+
+# Velden uit stationmeasurements die als getal in de tabel komen
+velden = (
+    "stationid", "temperature", "feeltemperature", "groundtemperature", "humidity",
+    "windspeed", "windgusts", "winddirectiondegrees", "airpressure", "visibility",
+    "precipitation", "sunpower", "rainFallLastHour", "rainFallLast24Hour",
+)
+
+richtingen = np.array(['N', 'NNO', 'NO', 'ONO', 'O', 'OZO', 'ZO', 'ZZO',
+                       'Z', 'ZZW', 'ZW', 'WZW', 'W', 'WNW', 'NW', 'NNW', 'Onbekend'])
+
+# Ondergrenzen van Beaufort 1 tot en met 12, in m/s
+beaufort_grenzen = np.array([0.3, 1.6, 3.4, 5.5, 8.0, 10.8, 13.9, 17.2, 20.8, 24.5, 28.5, 32.7])
+
+def getal(waarde):
+    if isinstance(waarde, (int, float)) and not isinstance(waarde, bool):
+        return waarde
+    try:
+        return float(waarde)
+    except (ValueError, TypeError):
+        return np.nan
+
+class MeetTabel:
+    def __init__(self, stations):
+        self.stations = stations
+        self.namen = np.array([s.get('stationname', '').strip() for s in stations], dtype=object)
+        self.regios = np.array([s.get('regio', '') for s in stations], dtype=object)
+        self.kolommen = {
+            veld: np.fromiter((getal(s.get(veld)) for s in stations), dtype=np.float64, count=len(stations))
+            for veld in velden
+        }
+        self.bereken()
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __getitem__(self, veld):
+        return self.kolommen[veld]
+
+    def bereken(self):
+        k = self.kolommen
+        with np.errstate(invalid="ignore", divide="ignore"):
+            k["windspeed_kmh"] = np.round(k["windspeed"] * 3.6, 1)
+            k["windgusts_kmh"] = np.round(k["windgusts"] * 3.6, 1)
+            k["beaufort"] = np.where(np.isnan(k["windspeed"]), np.nan, np.searchsorted(beaufort_grenzen, k["windspeed"], side="right"))
+            k["windchill"] = windchill(k["temperature"], k["windspeed_kmh"])
+            k["dewpoint"] = dauwpunt(k["temperature"], k["humidity"])
+
+        # Kompasrichting als index in richtingen, 16 voor onbekend
+        graden = k["winddirectiondegrees"]
+        index = np.full(len(graden), 16, dtype=np.intp)
+        bekend = ~np.isnan(graden)
+        index[bekend] = np.rint(graden[bekend] / 22.5).astype(np.intp) % 16
+        self.kompas = richtingen[index]
+
+    # Indexen van de n stations met de hoogste (of laagste) waarde, stations zonder waarde tellen niet mee
+    def rangschik(self, veld, n=None, aflopend=True):
+        kolom = self.kolommen[veld]
+        bekend = np.flatnonzero(~np.isnan(kolom))
+        volgorde = bekend[np.argsort(-kolom[bekend] if aflopend else kolom[bekend], kind="stable")]
+        return volgorde[:n] if n is not None else volgorde
+
+    def warmste(self, n=3):
+        return self.rangschik("temperature", n, aflopend=True)
+
+    def koudste(self, n=3):
+        return self.rangschik("temperature", n, aflopend=False)
+
+    # Alle waarden van één station als dict, NaN wordt None
+    def rij(self, index):
+        uitvoer = {"stationname": self.namen[index], "regio": self.regios[index], "kompas": str(self.kompas[index])}
+        for veld, kolom in self.kolommen.items():
+            waarde = float(kolom[index])
+            uitvoer[veld] = None if np.isnan(waarde) else waarde
+        return uitvoer
+
+# Gevoelstemperatuur volgens de JAG/TI-formule (zoals het KNMI), temperatuur in °C en wind in km/u.
+# Alleen gedefinieerd bij 10 °C of kouder en meer dan 4,8 km/u wind; anders is het gewoon de temperatuur
+def windchill(temperatuur, wind_kmh):
+    v = np.power(wind_kmh, 0.16)
+    chill = 13.12 + 0.6215 * temperatuur - 11.37 * v + 0.3965 * temperatuur * v
+    return np.where((temperatuur <= 10) & (wind_kmh > 4.8), np.round(chill, 1), temperatuur)
+
+# Dauwpunt met de Magnus-formule, temperatuur in °C en relatieve luchtvochtigheid in procent
+def dauwpunt(temperatuur, vochtigheid, a=17.62, b=243.12):
+    gamma = np.log(np.where(vochtigheid > 0, vochtigheid, np.nan) / 100) + a * temperatuur / (b + temperatuur)
+    return np.round(b * gamma / (a - gamma), 1)
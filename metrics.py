@@ -0,0 +1,113 @@
+     #########  ##############  #######
+    ##     ##  ##    ##    ##  ##
+   ##     ##  ##    ##    ##  #######
+  ##     ##  ##    ##    ##       ##
+ ##     ##  ##    ##    ##  #######
+
+# Stage timings and counters for CIMS
+# Off by default, and then stage() and count() return straight away, so the calls can stay in the hot paths.
+# Switch on with metrics.enabled = True, then write the totals out with writePrometheus and/or writeJSON.
+#
+#	with metrics.stage("layout"):
+#		...
+#	metrics.count("packets_written", 24)
+
+import time, json
+from publish import publishFile
+
+enabled = False
+
+stages = {}	# Stage name -> [runs, wall seconds, CPU seconds]
+counters = {}	# Counter name -> total
+started = time.time()
+
+class Stage:
+	__slots__ = ("name", "wall", "cpu")
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.wall = time.perf_counter()
+		self.cpu = time.thread_time()	# Per thread, so a fetch running in the background doesn't count towards the stage
+		return self
+
+	def __exit__(self, *exception):
+		totals = stages.get(self.name)
+		if totals is None:
+			totals = stages[self.name] = [0, 0.0, 0.0]
+		totals[0] += 1
+		totals[1] += time.perf_counter() - self.wall
+		totals[2] += time.thread_time() - self.cpu
+		return False
+
+# Stands in for Stage while metrics are off
+class NoStage:
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		return False
+
+noStage = NoStage()
+
+def stage(name):
+	if not enabled:
+		return noStage
+	return Stage(name)
+
+def count(name, amount=1):
+	if not enabled:
+		return
+	counters[name] = counters.get(name, 0) + amount
+
+def reset():
+	stages.clear()
+	counters.clear()
+
+# Totals so far as plain data, for sending back from a worker process to be merged in the parent
+def snapshot():
+	return {"stages":{name:list(totals) for name, totals in stages.items()}, "counters":dict(counters)}
+
+def merge(other):
+	for name, (runs, wall, cpu) in other["stages"].items():
+		totals = stages.setdefault(name, [0, 0.0, 0.0])
+		totals[0] += runs
+		totals[1] += wall
+		totals[2] += cpu
+	for name, amount in other["counters"].items():
+		counters[name] = counters.get(name, 0) + amount
+
+def summary():
+	return {
+		"started":started,
+		"time":time.time(),
+		"stages":{name:{"runs":runs, "wall_seconds":round(wall, 6), "cpu_seconds":round(cpu, 6), "mean_wall_ms":round(wall / runs * 1000, 3) if runs else 0} for name, (runs, wall, cpu) in sorted(stages.items())},
+		"counters":dict(sorted(counters.items())),
+	}
+
+def writeJSON(filename):
+	publishFile(filename, json.dumps(summary(), indent=1).encode("utf-8"))
+
+# Prometheus text exposition format, for node_exporter's textfile collector.
+# Written atomically, since the collector may read the file at any moment.
+def writePrometheus(filename, prefix="cims"):
+	lines = []
+
+	def metric(name, kind, help, samples):
+		lines.append("# HELP " + prefix + "_" + name + " " + help)
+		lines.append("# TYPE " + prefix + "_" + name + " " + kind)
+		for labels, value in samples:
+			lines.append(prefix + "_" + name + labels + " " + repr(float(value)))
+
+	ordered = sorted(stages.items())
+	metric("stage_runs_total", "counter", "Number of times each stage ran", [('{stage="' + name + '"}', totals[0]) for name, totals in ordered])
+	metric("stage_seconds_total", "counter", "Wall time spent in each stage", [('{stage="' + name + '"}', totals[1]) for name, totals in ordered])
+	metric("stage_cpu_seconds_total", "counter", "CPU time spent in each stage", [('{stage="' + name + '"}', totals[2]) for name, totals in ordered])
+	for name, total in sorted(counters.items()):
+		metric(name + "_total", "counter", name.replace("_", " ").capitalize(), [("", total)])
+	metric("last_write_timestamp_seconds", "gauge", "When these metrics were written", [("", time.time())])
+
+	publishFile(filename, ("\n".join(lines) + "\n").encode("utf-8"))
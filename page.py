@@ -8,7 +8,8 @@
 # Page handling functions for CIMS
 # Nathan Dane, 2022
 
-import json, time, sys, copy
+import json, time, sys, re, io, mmap, os, hashlib, concurrent.futures
+from publish import publishFile
 
 def access_bit(data, num):
 	base = int(num // 8)
@@ -23,6 +24,7 @@ def clear_bit(value, bit):
 
 # De-Minify a teletext page object
 # Basically this takes care of all the inheritance stuff and returns fully-formed subpages
+# Global packets are shared between subpages rather than copied, so replace packets instead of modifying them in place
 def teletextDeMinify(page):
 	if "packets" in page:	# If there aren't any global packets, we're wasting our time
 		#print("nothing to expand")
@@ -46,9 +48,18 @@ def teletextDeMinify(page):
 			if "control" in page:
 				page["subpages"][subcode]["control"] = page["control"]
 		
+		rows = {packet["number"] for packet in subpage["packets"]}	# Rows this subpage already has
+		localSorted = all(a["number"] <= b["number"] for a, b in zip(subpage["packets"], subpage["packets"][1:]))
+		added = False
+		
 		for globalPacket in globalPackets:
-			if not any(globalPacket["number"] == packet["number"] for packet in subpage["packets"]):	# If there's no overriding local packet
-				page["subpages"][subcode]["packets"].append(copy.deepcopy(globalPacket))	# Add in the global packet
+			if globalPacket["number"] not in rows:	# If there's no overriding local packet
+				subpage["packets"].append(globalPacket)	# Add in the global packet
+				rows.add(globalPacket["number"])
+				added = True
+		
+		if added and localSorted:	# Keep sorted subpages sorted, so teletextMinify round-trips exactly
+			subpage["packets"].sort(key=lambda d: d['number'])
 	
 	if "packets" in page:
 		del page["packets"]
@@ -57,157 +68,264 @@ def teletextDeMinify(page):
 
 # Minify a teletext page object
 # Takes fully formed subpages, and makes common packets global
+# A packet is hoisted when every inheriting subpage has exactly one packet with that number, and they're all identical.
+# teletextDeMinify merges global packets back in row order, so the round trip gives back exactly the same
+# subpages, as long as each subpage's packets were sorted by number to begin with
 def teletextMinify(page):
 	if "subpages" not in page:	# Don't bother if there are no subpages
 		print("nothing to contract")
 		return page	# Return unchanged
+	
+	if "packets" in page:	# Already (partly) minified, so start again from fully formed subpages
+		page = teletextDeMinify(page)
+	
+	inheriting = [subpage for subpage in page["subpages"] if subpage.get("inherit", True)]
+	
+	if len(inheriting) < 2:	# Nothing to share with
+		return page
+	
+	# Packets by row number for each inheriting subpage
+	rowIndexes = []
+	for subpage in inheriting:
+		rows = {}
+		for packet in subpage["packets"]:
+			rows.setdefault(packet["number"], []).append(packet)
+		rowIndexes.append(rows)
+	
+	globalPackets = []
+	for number, candidates in rowIndexes[0].items():
+		if len(candidates) != 1:
+			continue
+		
+		if all(len(rows.get(number, [])) == 1 and rows[number][0] == candidates[0] for rows in rowIndexes[1:]):
+			globalPackets.append(candidates[0])
+	
+	if not globalPackets:
+		return page
+	
+	hoisted = {packet["number"] for packet in globalPackets}
+	
+	for subpage in inheriting:
+		subpage["packets"] = [packet for packet in subpage["packets"] if packet["number"] not in hoisted]
+	
+	page["packets"] = sorted(globalPackets, key=lambda d: d['number'])
+	
+	return page
 
-# Reads a .tti file into a standard teletext JSON object.
-# Note that this is not a "minified" object (no inheritance, etc)
-def loadTTI(filename):
-	# Read in the file
-	tti = open(filename, "r")
-	ttiContent = tti.readlines()
-	tti.close()
+# .tti parsing. Each handler takes the parser state and the text after the command.
+# "output" is the page being built, "current" the subpage being built.
+
+# Page number
+def ttiPN(state, value):
+	page_number = value[:3]	# Cut out the number bit
+	if "number" in state["output"]:	# What if we already have a number for this page?
+		if state["output"]["number"] != page_number:	# Is this the same as what we have?
+			state["finished"].append(state["output"])	# A new page has started, hand the old one over
+			state["output"] = {"subpages":[]}
+			state["subpageCounter"] = 0
+		else:
+			return
+	state["output"]["number"] = page_number	# Otherwise, this is our page number now
+
+# Page subcode
+def ttiSC(state, value):
+	# Subcode should only be defined if it's not what we would logically expect
+	if (state["subpageCounter"] + 1) != int(value):
+		state["current"]["subcode"] = value
+
+# Page options
+def ttiPS(state, value):
+	raw_page_status = bytearray.fromhex(value)
+	current = state["current"]
 	
-	# initialise variables for later
-	output = {"subpages":[]}
-	current = {}
-	newPage = True
-	subpageCounter = 0	# We only use this to check if the subcode makes sense
+	# Language is composed from three bits. Pretty sure this isn't the right order, either...
+	language = (access_bit(raw_page_status,15) << 2) + (access_bit(raw_page_status,0) << 1) + access_bit(raw_page_status,1)
 	
-	for line in ttiContent:
-		line = line.strip() # Remove any trailing whitespace
+	if "control" not in current:
+		current["control"] = {}
 		
-		# If an "attribute" comes through after an OL or FL, we assume this is a new page
-		if line[:line.index(",")] in ["PN","SC","PS","CT"] and newPage:
-			if current:
-				if "packets" in current:
-					current["packets"] = sorted(current["packets"],key = lambda d: d['number'])
-					output["subpages"].append(current)	# If the current subpage isn't empty, write it to the output
-					subpageCounter += 1
-			
-			newPage = False	# Reset 
-			current = {}	# Create a fresh new subpage
+	if access_bit(raw_page_status,6) == 1:
+		current["control"]["erasePage"] = True
+	if access_bit(raw_page_status,8) == 1:
+		current["control"]["newsFlash"] = True
+	if access_bit(raw_page_status,9) == 1:
+		current["control"]["subtitle"] = True
+	if access_bit(raw_page_status,10) == 1:
+		current["control"]["suppressHeader"] = True
+	if access_bit(raw_page_status,11) == 1:
+		current["control"]["update"] = True
+	if access_bit(raw_page_status,13) == 1:
+		current["control"]["suppressPage"] = True
+	if access_bit(raw_page_status,12) == 1: # ?
+		current["control"]["interruptedSequence"] = True
+	
+	# Only output the language bit if it's not zero
+	if language != 0:
+		current["control"]["language"] = language
+
+# Page cycle time. We ignore this for the time being
+def ttiCT(state, value):
+	state["current"].setdefault("control", {})["cycleTime"] = value
+
+# Fasttext! A lot of the exciting stuff can be ignored here
+# as it's not implemented in .tti
+def ttiFL(state, value):
+	state["current"].setdefault("packets", []).append({"number":27, "dc":0, "linking":{"pages":value.split(',')}})
+
+ttiEscape = re.compile("\x1b(.?)", re.DOTALL)
+
+# Output Lines (packets)
+# For the moment we only care about packets 0-25 - no level 2.5 here :(
+def ttiOL(state, value):
+	state["newPage"] = True
+	packet_number, _, packet_content = value.partition(",")
+	packet_number = int(packet_number)
+	
+	if (packet_number < 26) and (packet_number != 0):
+		def unescape(match):	# Get the escaped character and subtract 0x40 to make it normal
+			if match.group(1) and ord(match.group(1)) >= 0x40:
+				return chr(ord(match.group(1)) - 0x40)
+			if match.group(1):
+				print("loadTTI: error on page " + str(state["output"].get("number")) + " " + str(match.start() + 1) + " " + match.group(1))
+			return ""
 		
-		# Get the page number
-		if line[:line.index(",")] == "PN":
-			page_number = line[line.index(",") + 1:line.index(",") + 4]	# Find the "," and cut out the number bit
-			if "number" in output:	# What if we already have a number for this page?
-				if output["number"] != str(page_number):	# Is this the same as what we have?
-					print("More than one page in this tti " + str(filename))	# Oh no, a weird page has appeared
-					exit()	# This will be a return later
-			else:
-				output["number"] = str(page_number)	# Otherwise, this is our page number now
+		if "\x1b" in packet_content:
+			packet_content = ttiEscape.sub(unescape, packet_content)
 		
-		# Get the page subcode
-		elif line[:line.index(",")] == "SC":
-			subcode = line[line.index(",") + 1:]
-			# Subcode should only be defined if it's not what we would logically expect
-			if (subpageCounter + 1) != int(subcode):
-				current["subcode"] = str(subcode)
-				#print(subpageCounter + 1)
-				#print(int(subcode))
+		state["current"].setdefault("packets", []).append({"number":packet_number, "text":packet_content})
+
+# Meta isn't in the spec yet, officially, so DE isn't handled
+ttiCommands = {b"PN":ttiPN, b"SC":ttiSC, b"PS":ttiPS, b"CT":ttiCT, b"FL":ttiFL, b"OL":ttiOL}
+
+# If an "attribute" comes through after an OL or FL, we assume this is a new subpage
+ttiSubpageCommands = {b"PN", b"SC", b"PS", b"CT"}
+
+# Write out the current subpage, if it isn't empty
+def ttiFlush(state):
+	current = state["current"]
+	if current and "packets" in current:
+		current["packets"] = sorted(current["packets"], key=lambda d: d['number'])
+		state["output"]["subpages"].append(current)
+		state["subpageCounter"] += 1
+
+# Reads a .tti file, which may hold any number of pages, and yields each page as a standard teletext JSON object.
+# The file is read line by line (or through a memory map, with mmapped=True) so large service dumps never sit in memory.
+# Note that these are not "minified" objects (no inheritance, etc)
+def iterTTI(filename, mmapped=False, encoding="utf-8"):
+	state = {"output":{"subpages":[]}, "current":{}, "newPage":True, "subpageCounter":0, "finished":[]}
+	
+	with open(filename, "rb") as tti:
+		if mmapped:
+			try:
+				lines = mmap.mmap(tti.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:	# Empty files can't be mapped
+				lines = io.BytesIO()
+		else:
+			lines = tti
 		
-		# Get the page options
-		elif line[:line.index(",")] == "PS":
-			raw_page_status = bytearray.fromhex(line[line.index(",") + 1:])
+		for line in iter(lines.readline, b""):
+			command = line[:2]
+			handler = ttiCommands.get(command)
 			
-			# Language is composed from three bits. Pretty sure this isn't the right order, either...
-			language = (access_bit(raw_page_status,15) << 2) + (access_bit(raw_page_status,0) << 1) + access_bit(raw_page_status,1)
+			if handler is None or line[2:3] != b",":
+				continue
 			
-			if "control" not in current:
-				current["control"] = {}
-				
-			if access_bit(raw_page_status,6) == 1:
-				current["control"]["erasePage"] = True
-			if access_bit(raw_page_status,8) == 1:
-				current["control"]["newsFlash"] = True
-			if access_bit(raw_page_status,9) == 1:
-				current["control"]["subtitle"] = True
-			if access_bit(raw_page_status,10) == 1:
-				current["control"]["suppressHeader"] = True
-			if access_bit(raw_page_status,11) == 1:
-				current["control"]["update"] = True
-			if access_bit(raw_page_status,13) == 1:
-				current["control"]["suppressPage"] = True
-			if access_bit(raw_page_status,12) == 1: # ?
-				current["control"]["interruptedSequence"] = True
+			if command in ttiSubpageCommands and state["newPage"]:
+				ttiFlush(state)
+				state["newPage"] = False	# Reset
+				state["current"] = {}	# Create a fresh new subpage
 			
-			# Only output the language bit if it's not zero
-			if language != 0:
-				current["control"]["language"] = language
-		
-		# Page cycle time. We ignore this for the time being 
-		elif line[:line.index(",")] == "CT":
-			if "control" not in current:
-				current["control"] = {}
-			current["control"]["cycleTime"] = line[line.index(",") + 1:]
-		#	print("Cycle Time: " + line[line.index(",") + 1:])
-		
-		# Fasttext! A lot of the exciting stuff can be ignored here
-		# as it's not implemented in .tti
-		elif line[:line.index(",")] == "FL":
-			fasttext = line[line.index(",") + 1:].split(',')
+			handler(state, line[3:].decode(encoding, errors="replace").rstrip())
 			
-			if "packets" in current:
-				current["packets"].append({"number":27, "dc":0, "linking":{"pages":fasttext}})
-			else:
-				current["packets"] = [{"number":27, "dc":0, "linking":{"pages":fasttext}}]
+			while state["finished"]:
+				yield state["finished"].pop(0)
 		
-		# Output Lines (packets)
-		# For the moment we only care about packets 0-25 - no level 2.5 here :(
-		elif line[:line.index(",")] == "OL":
-			newPage = True
-			packet_number = int(line[line.index(",") + 1:line.index(",",3)])
-			packet_content = line[line.index(",",3) + 1:]
-			
-			if (packet_number < 26) and (packet_number != 0):
-				esc = False
-				unescapedPacket = ""
-				for position, character in enumerate(packet_content): # Un-escape the lines
-					if esc:
-						esc = False
-						try:
-							unescapedPacket += chr(ord(character) - 0x40)	# Get the escaped character and subtract 0x40 to make it normal
-						except:
-							print("loadTTI: error on page " + str(output["number"]) + " " + str(position) + " " + character)
-							continue
-						
-						continue	# Skip straight on to the next character
-					if character == "":	# Tell us that the next character is escaped
-						esc = True
-					else:
-						unescapedPacket += character	# Pass other characters on through
-				
-				if "packets" in current:
-					current["packets"].append({"number":packet_number, "text":unescapedPacket})
-				else:
-					current["packets"] = [{"number":packet_number, "text":unescapedPacket}]
-		
-		# Meta isn't in the spec yet, officially
-		#elif line[:line.index(",")] == "DE":	# This isn't important, and has no bearing on the page
-		#	if "meta" in output:
-		#		output["meta"]["title"] = line[line.index(",") + 1:]
-		#	else:
-		#		output["meta"] = {"title":line[line.index(",") + 1:]}
+		if mmapped:
+			lines.close()
 	
 	# Write out final subpage
-	if current:
-		if "packets" in current:
-			current["packets"]=sorted(current["packets"],key=lambda d: d['number'])
-			output["subpages"].append(current)	# If the current subpage isn't empty, write it to the output
+	ttiFlush(state)
 	
-	# This is a form of minification, which I've now decided will be taken care of elsewhere
-	#if len(output["subpages"]) == 1:	# If there's only one subpage
-	#	output = dict(**output, **output["subpages"][0])
-	#	del output["subpages"]
-	#	del output["subcode"]
+	if "number" in state["output"] or state["output"]["subpages"]:
+		yield state["output"]
 
+# Reads a single-page .tti file into a standard teletext JSON object.
+def loadTTI(filename):
+	pages = iterTTI(filename)
+	output = next(pages, {"subpages":[]})
+	
+	if next(pages, None) is not None:
+		print("More than one page in this tti " + str(filename) + ", only the first was loaded")
+	
+	pages.close()
 	return(output)
 
-# Export a standard teletext object to a .tti file
-def exportTTI(page):
+# Parsed templates, keyed on filename, as (mtime, size, page)
+templateCache = {}
+
+# Copy a packet list without going through copy.deepcopy. Text is immutable, so only
+# the packet dicts (and fastext link lists) need copying
+def copyPackets(packets):
+	output = []
+	for packet in packets:
+		packet = dict(packet)
+		if "linking" in packet:
+			packet["linking"] = {key:list(value) if isinstance(value, list) else value for key, value in packet["linking"].items()}
+		output.append(packet)
+	return output
+
+# Load a .tti template, parsing it only when it has changed on disk (by mtime and size).
+# With diskCache=True the parsed page is also kept in a compact JSON file next to the
+# template, so a fresh process doesn't have to parse it either.
+# The returned page is shared between callers, so don't modify it - use templatePackets for a copy.
+def loadTemplate(filename, diskCache=False):
+	stat = os.stat(filename)
+	key = (stat.st_mtime_ns, stat.st_size)
+	
+	if filename in templateCache and templateCache[filename][0] == key:
+		return templateCache[filename][1]
+	
+	page = None
+	cacheFilename = filename + ".cache"
+	
+	if diskCache:
+		try:
+			with open(cacheFilename, "r", encoding="utf-8") as f:
+				cached = json.load(f)
+			if cached["mtime"] == key[0] and cached["size"] == key[1]:
+				page = cached["page"]
+		except (OSError, ValueError, KeyError):
+			pass	# No usable cache, parse the template instead
+	
+	if page is None:
+		page = loadTTI(filename)
+		
+		if diskCache:
+			try:	# Published atomically, since several worker processes can load the same template at once
+				publishFile(cacheFilename, json.dumps({"mtime":key[0], "size":key[1], "page":page}, ensure_ascii=False, separators=(",",":")).encode("utf-8"))
+			except OSError:
+				print("loadTemplate: couldn't write cache for " + str(filename))
+	
+	templateCache[filename] = (key, page)
+	return page
+
+# A fresh copy of one subpage's packets from a cached template
+def templatePackets(filename, subpage=0, diskCache=False):
+	return copyPackets(loadTemplate(filename, diskCache)["subpages"][subpage]["packets"])
+
+# Raised when a page can't be exported
+class ExportError(Exception):
+	pass
+
+# Render a standard teletext object to a list of .tti lines. Raises ExportError if it can't be.
+# Warnings are printed, or collected in the warnings list if one is given.
+def renderTTI(page, warnings=None):
+	def warn(message):
+		if warnings is None:
+			print(message)
+		else:
+			warnings.append(message)
+	
 	page_number = page["number"]
 	output = []
 	
@@ -225,8 +343,7 @@ def exportTTI(page):
 			subcode = str(guessed_subcode + subcodeOffset).zfill(4)
 		
 		if int(subcode) > 99:
-			print("This page has more than 99 subpages. For our purposes, .tti doesn't support that")
-			return False;
+			raise ExportError("This page has more than 99 subpages. For our purposes, .tti doesn't support that")
 		
 		output.append("PN," + str(page_number) + subcode[2:])
 		output.append("SC," + str(subcode))
@@ -269,7 +386,7 @@ def exportTTI(page):
 				if packet["number"] > 0 and packet["number"] < 27:
 					escapedPacket = ""
 					if len(packet["text"]) > 40:
-						print("P" + page_number + " Packet longer than 40 bytes - " + packet["text"])
+						warn("P" + str(page_number) + " Packet longer than 40 bytes - " + packet["text"])
 					for character in packet["text"]:
 						if ord(character) < 0x20:
 							escapedPacket = escapedPacket + chr(27) + chr(ord(character) + 0x40)
@@ -277,14 +394,13 @@ def exportTTI(page):
 							escapedPacket = escapedPacket + character
 						
 						if ord(character) >=128:
-							print("Unsafe Character on P" + str(page_number) + " S" + str(subcode))
+							warn("Unsafe Character on P" + str(page_number) + " S" + str(subcode))
 						
 					output.append("OL," + str(packet["number"]) + "," + escapedPacket)
 			
 			if "linking" in packet:
 				if packet["number"] != 27:
-					print("Unexpected linking packet")
-					return False
+					raise ExportError("Unexpected linking packet")
 					
 				fasttext = "FL"
 				
@@ -297,11 +413,88 @@ def exportTTI(page):
 					
 					output.append(fasttext)
 	
-	filename = "teletext/P" + str(page_number) + ".tti"
+	return output
+
+# Fingerprint of rendered .tti lines, leaving out the header rows since they carry the time
+def ttiFingerprint(lines):
+	fingerprint = hashlib.blake2b(digest_size=16)
+	for line in lines:
+		if not line.startswith("OL,0,"):
+			fingerprint.update(line.encode("utf-8", errors="surrogatepass") + b"\r\n")
+	return fingerprint.hexdigest()
+
+# Fingerprint of a standard teletext object as it is, minified or not, leaving out row 0.
+# The page isn't de-minified, sorted or rendered, so this is cheap enough to call on every refresh,
+# but the minified and expanded forms of a page (or the same packets in another order) count as different
+def pageFingerprint(page):
+	def rows(packets):
+		return [packet for packet in packets if packet.get("number") != 0]
+	
+	content = dict(page, packets=rows(page.get("packets", [])), subpages=[dict(subpage, packets=rows(subpage.get("packets", []))) for subpage in page.get("subpages", [])])
+	return hashlib.blake2b(json.dumps(content, sort_keys=True, separators=(",",":"), default=str).encode("utf-8"), digest_size=16).hexdigest()
+
+# Fingerprints of the last export to each file, so unchanged pages aren't written again
+# Filename -> ((mtime, size) of the file, fingerprint of its contents)
+exportFingerprints = {}
+
+# Write a standard teletext object to directory/P<number>.tti. Raises ExportError if it can't be rendered.
+# Returns True if the file was written, None if incremental and unchanged.
+def writeTTI(page, directory="teletext", incremental=False, fsync="none", lock=False, warnings=None):
+	output = renderTTI(page, warnings)
+	filename = os.path.join(directory, "P" + str(page["number"]) + ".tti")
 	
-	with open(filename, 'w') as f:
-		for line in output:
-			f.write("%s\r\n" % line)
+	if incremental:
+		fingerprint = ttiFingerprint(output)
+		
+		try:
+			with open(filename, 'r', encoding='utf-8', newline='') as f:
+				stat = os.fstat(f.fileno())
+				key = (stat.st_mtime_ns, stat.st_size)
+				
+				# First export in this process, or the file changed on disk since, so fingerprint what's there now
+				if filename not in exportFingerprints or exportFingerprints[filename][0] != key:
+					exportFingerprints[filename] = (key, ttiFingerprint(line.rstrip("\r\n") for line in f))
+			
+			if exportFingerprints[filename][1] == fingerprint:
+				return None
+		except (OSError, ValueError):
+			pass	# Missing or unreadable, so write it whatever we exported last time
+	
+	publishFile(filename, "".join("%s\r\n" % line for line in output).encode("utf-8"), fsync, lock)
+	
+	if incremental:
+		stat = os.stat(filename)
+		exportFingerprints[filename] = ((stat.st_mtime_ns, stat.st_size), fingerprint)
+	
+	return True
+
+# Export a standard teletext object to a .tti file
+# With incremental=True the file is only written when something other than the header changed.
+# The file is replaced atomically; fsync and lock are passed on to publish.publishFile.
+# Returns True if the file was written, None if it was unchanged and False on error.
+def exportTTI(page, incremental=False, fsync="none", lock=False, directory="teletext"):
+	try:
+		return writeTTI(page, directory, incremental, fsync, lock)
+	except ExportError as e:
+		print(e)
+		return False
+
+# Export many pages at once, rendering and writing them on a pool of up to workers threads.
+# Returns one result per page, in the same order:
+#	{"number":..., "filename":..., "status":"written"/"unchanged"/"error", "error":..., "warnings":[...]}
+def exportPages(pages, directory="teletext", workers=4, incremental=False, fsync="none", lock=False):
+	def exportOne(page):
+		result = {"number":page.get("number"), "filename":os.path.join(directory, "P" + str(page.get("number")) + ".tti"), "warnings":[]}
+		try:
+			written = writeTTI(page, directory, incremental, fsync, lock, result["warnings"])
+			result["status"] = "written" if written else "unchanged"
+		except (ExportError, OSError, KeyError, ValueError) as e:
+			result["status"] = "error"
+			result["error"] = str(e) or type(e).__name__
+		return result
+	
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+		return list(pool.map(exportOne, pages))
 
 #	How about an out-of-band flag, like a meta tag or something, to signal when this should be done!?
 def numberSubpage(page, row=20, offset=1, prefix=chr(7), align="right"):
@@ -341,11 +534,11 @@ def numberSubpage(page, row=20, offset=1, prefix=chr(7), align="right"):
 				# First, pad the string to 40 chars. There's nothing in the spec to say this will be done for us
 				# Cut the string to length and add the counter onto the end
 				# ToDo: if the offset is large enough, add the end of the string back on again?
-				subpage["packets"][positionInList]["text"] = subpage["packets"][positionInList]["text"].ljust(40)[:(40 - (counterLen + offset))] + counter
+				subpage["packets"][positionInList] = dict(subpage["packets"][positionInList], text=subpage["packets"][positionInList]["text"].ljust(40)[:(40 - (counterLen + offset))] + counter)
 			elif align == "left":
 				# Here the offset is added to the left as spaces.
 				# ToDo: again, we should just add the left part of the packet if there's too much offset
-				subpage["packets"][positionInList]["text"] = (" " * offset) + counter + subpage["packets"][positionInList]["text"].ljust(40)[((counterLen + offset)):]
+				subpage["packets"][positionInList] = dict(subpage["packets"][positionInList], text=(" " * offset) + counter + subpage["packets"][positionInList]["text"].ljust(40)[((counterLen + offset)):])
 		
 		else:
 			if align == "right":
@@ -358,7 +551,16 @@ def numberSubpage(page, row=20, offset=1, prefix=chr(7), align="right"):
 	
 	return page
 
+# Compare two pages. Either side can also be a fingerprint from pageFingerprint,
+# in which case the fingerprints are compared instead of the packets
 def comparison(pageA,pageB,debug=False):
+	if isinstance(pageA, str) or isinstance(pageB, str):
+		if not isinstance(pageA, str):
+			pageA = pageFingerprint(pageA)
+		if not isinstance(pageB, str):
+			pageB = pageFingerprint(pageB)
+		return pageA == pageB
+	
 	pageA = teletextDeMinify(pageA)
 	pageB = teletextDeMinify(pageB)
 	
@@ -380,26 +582,45 @@ def comparison(pageA,pageB,debug=False):
 	
 	return True
 
+# Overlay a block of packets onto a packet list, covering columns startx to endx on rows starty to endy.
+# Row 1 of the overlay goes on row starty, and so on. Neither input is modified: the result is a new list,
+# with new packets for the rows that changed and the untouched packets shared with rawSource.
 def blockOverlay(rawSource,overlay,startx,starty,endx,endy,align="centre"):
-	source = copy.deepcopy(rawSource)
+	return blockOverlays(rawSource,[(overlay,startx,starty,endx,endy,align)])
+
+# Apply many overlays in one go. Each overlay is a tuple of (overlay,startx,starty,endx,endy[,align]),
+# applied in order. Rows are composed in a working buffer and only turned back into packets at the end.
+def blockOverlays(rawSource,overlays):
+	source = list(rawSource)
+	positions = {}	# Row number -> position of its (first) packet in source
+	for position, packet in enumerate(source):
+		positions.setdefault(packet["number"], position)
 	
-	if startx > endx or starty > endy:
-		print("blockOverlay: Grid input fault")
-		return source
+	rows = {}	# Row number -> composed text, for rows we've touched
 	
-	for itNum,rowNum in enumerate(range(starty,endy+1)):
-		positionInSourceList = next((i for i, packet in enumerate(source) if packet["number"] == rowNum), None)
-		positionInOverlayList = next((i for i, packet in enumerate(overlay) if packet["number"] == itNum+1), None)
-		
-		if positionInSourceList == None:
-			source.append({"number":rowNum,"text":"                                        "})
-			positionInSourceList = next((i for i, packet in enumerate(source) if packet["number"] == rowNum), None)
+	for overlay, startx, starty, endx, endy, *rest in overlays:
+		if startx > endx or starty > endy:
+			print("blockOverlay: Grid input fault")
+			continue
 		
-		if positionInOverlayList == None:
-			overlay.append({"number":itNum+1,"text":"                                        "})
-			positionInOverlayList = next((i for i, packet in enumerate(overlay) if packet["number"] == itNum+1), None)
+		overlayRows = {}
+		for packet in overlay:
+			overlayRows.setdefault(packet["number"], packet["text"])
 		
-		source[positionInSourceList]["text"] = (source[positionInSourceList]["text"].ljust(40," ")[:startx] + overlay[positionInOverlayList]["text"].ljust(40," ")[:(endx-startx)] + source[positionInSourceList]["text"][endx:])
+		for itNum,rowNum in enumerate(range(starty,endy+1)):
+			if rowNum not in rows:
+				if rowNum not in positions:
+					source.append({"number":rowNum,"text":"                                        "})
+					positions[rowNum] = len(source) - 1
+				rows[rowNum] = source[positions[rowNum]]["text"]
+			
+			text = rows[rowNum]
+			overlayText = overlayRows.get(itNum+1, "")
+			rows[rowNum] = text.ljust(40," ")[:startx] + overlayText.ljust(40," ")[:(endx-startx)] + text[endx:]
+	
+	for rowNum, text in rows.items():
+		if source[positions[rowNum]]["text"] != text:
+			source[positions[rowNum]] = dict(source[positions[rowNum]], text=text)
 	
 	return source
 
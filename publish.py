@@ -0,0 +1,67 @@
+     #########  ##############  #######
+    ##     ##  ##    ##    ##  ##
+   ##     ##  ##    ##    ##  #######
+  ##     ##  ##    ##    ##       ##
+ ##     ##  ##    ##    ##  #######
+
+# Crash-safe page publishing for CIMS
+# Pages are written to a temporary file in the target directory and renamed into place,
+# so anything polling that directory only ever sees complete pages
+
+import os, tempfile, contextlib
+
+try:
+	import fcntl
+except ImportError:	# No flock on this platform, so directory locks are a no-op
+	fcntl = None
+
+# fsync policies:
+#	"none"      - leave it to the OS (fast, but a power cut can leave an empty page)
+#	"file"      - fsync the page before renaming it into place
+#	"directory" - also fsync the directory, so the rename itself survives a power cut
+fsyncPolicies = ("none", "file", "directory")
+
+# Hold an exclusive lock on a directory while publishing into it, so several
+# generator processes can share one output directory
+@contextlib.contextmanager
+def directoryLock(directory):
+	if fcntl is None:
+		yield
+		return
+
+	with open(os.path.join(directory, ".lock"), "a") as lockFile:
+		fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+
+# Atomically replace filename with data (bytes)
+def publishFile(filename, data, fsync="none", lock=False):
+	if fsync not in fsyncPolicies:
+		raise ValueError("publishFile: unknown fsync policy " + repr(fsync))
+
+	directory = os.path.dirname(filename) or "."
+
+	with directoryLock(directory) if lock else contextlib.nullcontext():
+		descriptor, temporary = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(filename) + ".", suffix=".tmp")
+		try:
+			with os.fdopen(descriptor, "wb") as f:
+				f.write(data)
+				if fsync != "none":
+					f.flush()
+					os.fsync(f.fileno())
+
+			os.chmod(temporary, 0o644)	# mkstemp makes the file private, but the inserter needs to read it
+			os.replace(temporary, filename)
+		except BaseException:
+			with contextlib.suppress(OSError):
+				os.unlink(temporary)
+			raise
+
+		if fsync == "directory":
+			directoryDescriptor = os.open(directory, os.O_RDONLY)
+			try:
+				os.fsync(directoryDescriptor)
+			finally:
+				os.close(directoryDescriptor)
@@ -0,0 +1,193 @@
+     #########  ##############  #######
+    ##     ##  ##    ##    ##  ##
+   ##     ##  ##    ##    ##  #######
+  ##     ##  ##    ##    ##       ##
+ ##     ##  ##    ##    ##  #######
+
+# T42 packet encoding for CIMS
+# Turns standard teletext objects into ready-to-broadcast 42 byte packets,
+# so the inserter doesn't have to parse .tti files on every carousel pass
+
+import time, os, codecs
+from page import teletextDeMinify
+from publish import publishFile
+
+# Odd parity for 7 bit characters. Anything above 7 bits goes out as 0x7f, like the legaliser does
+def oddParity(value):
+	value &= 0x7f
+	if bin(value).count("1") % 2 == 0:
+		value |= 0x80
+	return value
+
+parityTable = bytes(oddParity(c) if c < 128 else oddParity(0x7f) for c in range(256))
+
+# Characters that aren't in latin-1 at all are encoded as 0x7f too, rather than as "?"
+codecs.register_error("t42", lambda error: ("\x7f" * (error.end - error.start), error.end))
+
+# Hamming 8/4, for addresses and other control data
+# Bits are transmitted LSB first as P1 D1 P2 D2 P3 D3 P4 D4
+def hamming84(value):
+	d1, d2, d3, d4 = [(value >> bit) & 1 for bit in range(4)]
+	p1 = 1 ^ d1 ^ d3 ^ d4
+	p2 = 1 ^ d1 ^ d2 ^ d4
+	p3 = 1 ^ d1 ^ d2 ^ d3
+	p4 = 1 ^ p1 ^ d1 ^ p2 ^ d2 ^ p3 ^ d3 ^ d4
+	return p1 | (d1 << 1) | (p2 << 2) | (d2 << 3) | (p3 << 4) | (d3 << 5) | (p4 << 6) | (d4 << 7)
+
+hamming84Table = bytes(hamming84(value) for value in range(16))
+
+# Hamming 24/18, for packet 26 triplets
+# Parity bits sit at positions 1, 2, 4, 8 and 16 (counting from 1), with the final bit making the whole codeword odd
+def hamming2418(value):
+	codeword = 0
+	position = 1
+	for bit in range(18):
+		while position & (position - 1) == 0:	# skip parity positions
+			position += 1
+		if (value >> bit) & 1:
+			codeword |= 1 << (position - 1)
+		position += 1
+
+	for parity in range(5):
+		mask = 1 << parity
+		ones = sum((codeword >> (position - 1)) & 1 for position in range(1, 24) if position & mask)
+		if ones % 2 == 0:
+			codeword |= 1 << (mask - 1)
+
+	if bin(codeword).count("1") % 2 == 0:
+		codeword |= 1 << 23
+
+	return codeword
+
+# The code is affine, so a triplet can be encoded from three 6 bit chunk tables instead of one 2^18 table
+hamming2418Base = hamming2418(0)
+hamming2418Tables = [[hamming2418(chunk << shift) ^ hamming2418Base for chunk in range(64)] for shift in (0, 6, 12)]
+
+def encodeTriplet(triplet):
+	codeword = hamming2418Base ^ hamming2418Tables[0][triplet & 0x3f] ^ hamming2418Tables[1][(triplet >> 6) & 0x3f] ^ hamming2418Tables[2][(triplet >> 12) & 0x3f]
+	return codeword.to_bytes(3, "little")
+
+# Magazine and row address group
+def mrag(magazine, row):
+	return bytes((hamming84Table[(magazine & 7) | ((row & 1) << 3)], hamming84Table[row >> 1]))
+
+# Text to 40 (or fewer) odd parity bytes
+def displayBytes(text, length=40):
+	return text.ljust(length)[:length].encode("latin-1", errors="t42").translate(parityTable)
+
+# Split a page number like "300" or 0x1ff into magazine, tens and units
+def pageAddress(number):
+	number = int(str(number), 16)
+	return (number >> 8) & 7, (number >> 4) & 0xf, number & 0xf
+
+# Page status control bits, as used in exportTTI
+def headerControl(control):
+	c4 = 1 if control.get("erasePage") == True else 0
+	c5 = 1 if control.get("newsFlash") == True else 0
+	c6 = 1 if control.get("subtitle") == True else 0
+	c7 = 1 if control.get("suppressHeader") == True else 0
+	c8 = 1 if control.get("update") == True else 0
+	c9 = 1 if control.get("interruptedSequence") == True else 0
+	c10 = 1 if control.get("suppressPage") == True else 0
+	language = control.get("language", 0) & 7
+	return c4, c5, c6, c7 | (c8 << 1) | (c9 << 2) | (c10 << 3), language
+
+def headerPacket(page_number, subcode, control, serial=False):
+	magazine, tens, units = pageAddress(page_number)
+	c4, c5, c6, c7to10, language = headerControl(control)
+
+	packet = bytearray(mrag(magazine, 0))
+	packet += bytes((
+		hamming84Table[units],
+		hamming84Table[tens],
+		hamming84Table[subcode & 0xf],
+		hamming84Table[((subcode >> 4) & 0x7) | (c4 << 3)],
+		hamming84Table[(subcode >> 8) & 0xf],
+		hamming84Table[((subcode >> 12) & 0x3) | (c5 << 2) | (c6 << 3)],
+		hamming84Table[c7to10],
+		hamming84Table[(1 if serial else 0) | (language << 1)],
+	))
+
+	# Columns 8-39 of the header row, the same as exportTTI writes
+	packet += displayBytes(chr(5) + "CIMS" + chr(2) + chr(6) + str(page_number) + chr(1) + str(int(time.time())), 32)
+	return packet
+
+# Packet 26 text as written by legaliser.write_enhancements: a designation code, then 13 triplets of three 6 bit characters
+def enhancementPacket(magazine, text):
+	packet = bytearray(mrag(magazine, 26))
+	packet.append(hamming84Table[(ord(text[0]) - 0x40) & 0xf])
+
+	for t in range(13):
+		chunk = text[1+t*3:4+t*3].ljust(3, chr(0x7f))
+		triplet = ((ord(chunk[0]) - 0x40) & 0x3f) | (((ord(chunk[1]) - 0x40) & 0x3f) << 6) | (((ord(chunk[2]) - 0x40) & 0x3f) << 12)
+		packet += encodeTriplet(triplet)
+
+	return packet
+
+# Packet 27/0, the fastext links
+def linkPacket(magazine, links):
+	packet = bytearray(mrag(magazine, 27))
+	packet.append(hamming84Table[0])	# designation code
+
+	for link in (list(links) + ["8ff"] * 6)[:6]:
+		linkMagazine, tens, units = pageAddress(link)
+		relative = linkMagazine ^ magazine	# link magazines are sent relative to the current one
+		packet += bytes((
+			hamming84Table[units],
+			hamming84Table[tens],
+			hamming84Table[0xf],
+			hamming84Table[0x7 | ((relative & 1) << 3)],
+			hamming84Table[0xf],
+			hamming84Table[0x3 | ((relative >> 1) << 2)],
+		))
+
+	packet.append(hamming84Table[0xf])	# link control: display row 24
+	packet += bytes(2)	# page CRC, left for the inserter
+	return packet
+
+# Encode a standard teletext object as a stream of T42 packets
+def encodeT42(page, serial=False):
+	page_number = page["number"]
+	magazine = pageAddress(page_number)[0]
+	output = bytearray()
+
+	page = teletextDeMinify(page)
+
+	if len(page["subpages"]) > 1:
+		subcodeOffset = 1
+	else:
+		subcodeOffset = 0
+
+	for guessed_subcode, subpage in enumerate(page["subpages"]):
+		if "subcode" in subpage:
+			subcode = int(str(subpage["subcode"]), 16)
+		else:
+			subcode = int(str(guessed_subcode + subcodeOffset), 16)
+
+		control = subpage.get("control", page.get("control", {}))
+
+		output += headerPacket(page_number, subcode, control, serial)
+
+		# Packets 27 and 26 have to go out before the rows they apply to
+		packets = sorted(subpage["packets"], key=lambda d: (d["number"] < 26, d["number"] != 27, d["number"]))
+
+		for packet in packets:
+			if packet["number"] == 27:
+				if "linking" in packet and "pages" in packet["linking"]:
+					output += linkPacket(magazine, packet["linking"]["pages"])
+			elif packet["number"] == 26:
+				if "text" in packet:
+					output += enhancementPacket(magazine, packet["text"])
+			elif "text" in packet and 0 < packet["number"] < 26:
+				if len(packet["text"]) > 40:
+					print("P" + str(page_number) + " Packet longer than 40 bytes - " + packet["text"])
+				output += mrag(magazine, packet["number"]) + displayBytes(packet["text"])
+
+	return bytes(output)
+
+# Export a standard teletext object to a .t42 file, next to the .tti files
+# The file is replaced atomically; fsync and lock are passed on to publish.publishFile
+def exportT42(page, serial=False, fsync="none", lock=False, directory="teletext"):
+	filename = os.path.join(directory, "P" + str(page["number"]) + ".t42")
+
+	publishFile(filename, encodeT42(page, serial), fsync, lock)
@@ -10,7 +10,11 @@
 
 from legaliser import charsub
 import re
+import json
+import hashlib
 import logging
+import collections
+import functools
 from datetime import datetime
 
 def colourCode(colour):
@@ -31,7 +35,14 @@ def colourCode(colour):
 	else:
 		return " "
 
-# Table row will create one full-width line given data and a format object
+# Table cells repeat a lot (station names, units), so remember what charsub made of them
+cellCharsub = functools.lru_cache(maxsize=4096)(charsub)
+
+# Raised when a table format or its data can't be used
+class TableError(ValueError):
+	pass
+
+# A table format compiled once, for rendering many rows.
 # Example format:
 #[
 #	{"width":10,"data":"home","colour":"white"},
@@ -39,58 +50,85 @@ def colourCode(colour):
 #]
 # Total widths MUST add up to less than (40 - total_rows)
 # Width does not include colour code
-def tableRow(format, data):
-	output = ""
-	
-	for cell in format:
-		if "colour" in cell:
-			output += colourCode(cell["colour"])
+class TableFormatter:
+	def __init__(self, format):
+		self.cells = []	# (prefix, data key or None, round or None, width, aligner)
+		length = 0
 		
-		if "align" in cell:
-			align = cell["align"]
-		else:
-			align = "left"
+		for cell in format:
+			if "width" not in cell:
+				raise TableError("tableRow: cell has no defined width")
+			
+			width = cell["width"]
+			prefix = colourCode(cell["colour"]) if "colour" in cell else ""
+			align = cell.get("align", "left")
+			
+			if align == "right":
+				aligner = str.rjust
+			elif align == "centre":
+				aligner = str.center
+			else:
+				aligner = str.ljust
+			
+			if "data" in cell:
+				self.cells.append((prefix, cell["data"], cell.get("round"), width, aligner))
+			elif "text" in cell:
+				# Static text never changes, so it can be laid out now
+				self.cells.append((prefix + aligner(charsub(cell["text"])[:width], width), None, None, width, aligner))
+			else:
+				raise TableError("tableRow: Cell has no data input or text specified")
+			
+			length += len(prefix) + width
 		
-		if "width" not in cell:
-			print("tableRow: cell has no defined width")
-			return
+		# Every cell comes out exactly width long, so we know now whether rows will be too long
+		self.truncate = length > 40
+		if self.truncate:
+			print("tableRow: warning, output was longer than 40, truncated")
+	
+	# Render one row from a dict of data
+	def row(self, data):
+		output = []
 		
-		if "data" in cell:
-			if cell["data"] in data:
-				rawInput = data[cell["data"]]
-				
-				if "round" in cell:
-					rawInput = round(rawInput,cell["round"])
-				
-				if len(str(rawInput)) > cell["width"] and rawInput is int:
-					rawInput = round(rawInput)
-				
-				inputText = str(rawInput)
-			else:
-				print("tableRow: specified data absent")
-				return
-		elif "text" in cell:
-			inputText = cell["text"]
-		else:
-			print("tableRow: Cell has no data input or text specified")
-			return
+		for prefix, key, places, width, aligner in self.cells:
+			if key is None:
+				output.append(prefix)
+				continue
+			
+			if key not in data:
+				raise TableError("tableRow: specified data absent")
+			
+			rawInput = data[key]
+			
+			if places is not None:
+				rawInput = round(rawInput, places)
+			
+			output.append(prefix)
+			output.append(aligner(cellCharsub(str(rawInput))[:width], width))
 		
-		inputText = charsub(inputText)
+		output = "".join(output)
 		
-		if align == "right":
-			cellText = inputText[:cell["width"]].rjust(cell["width"])
-		elif align == "centre":
-			cellText = inputText[:cell["width"]].center(cell["width"])
-		else:
-			cellText = inputText[:cell["width"]].ljust(cell["width"])
+		if self.truncate:
+			output = output[:40]
 		
-		output += cellText
+		return output
 	
-	if len(output) > 40:
-		print("tableRow: warning, output was longer than 40, truncated")
-		output = output[:40]
+	# Render a row for each dict in a list
+	def rows(self, dataList):
+		return [self.row(data) for data in dataList]
 	
-	return output
+	# Render rows from columnar data, a dict of equal length lists
+	def columns(self, columnData):
+		keys = list(columnData)
+		return [self.row(dict(zip(keys, values))) for values in zip(*(columnData[key] for key in keys))]
+
+# Table row will create one full-width line given data and a format object (see TableFormatter)
+# Prints and returns None if the format or data is unusable
+def tableRow(format, data):
+	try:
+		return TableFormatter(format).row(data)
+	except TableError as e:
+		print(e)
+		return
 
 #print(tableRow(
 #	[
@@ -110,7 +148,70 @@ def colourCodeReplace(toggle,input,code="\r"):
 	else:
 		return code + input
 
-def toTeletextBlock(input,maxWidth=40,line=1,variable={}):
+# Look up a variable path the same way textColour does
+def variableValue(variable, path):
+	variable_part = variable
+	for key in path:
+		try:
+			variable_part = variable_part[key]
+		except:
+			variable_part = ""
+	return str(variable_part)
+
+# Bounded LRU cache of toTeletextBlock layouts. The key is a hash of the block spec,
+# the variable values the spec actually reads, maxWidth and the starting line.
+class LayoutCache:
+	def __init__(self, maxsize=256):
+		self.maxsize = maxsize
+		self.entries = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+	
+	def key(self, input, maxWidth, line, variable):
+		values = []
+		for group in input.get("content", []):
+			for chunk in group.get("content", []):
+				if "text" not in chunk and "variable" in chunk:
+					values.append(variableValue(variable, chunk["variable"]))
+		
+		canonical = json.dumps([input, values, maxWidth, line], sort_keys=True, separators=(",",":"), default=str)
+		return hashlib.blake2b(canonical.encode("utf-8", errors="surrogatepass"), digest_size=16).digest()
+	
+	def get(self, key):
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return self.entries[key]
+		self.misses += 1
+		return None
+	
+	def put(self, key, value):
+		self.entries[key] = value
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+	
+	def clear(self):
+		self.entries.clear()
+		self.hits = 0
+		self.misses = 0
+	
+	def stats(self):
+		return {"hits":self.hits, "misses":self.misses, "size":len(self.entries), "maxsize":self.maxsize}
+
+# Lay a block out as packets, starting at row line.
+# Pass a LayoutCache as cache to reuse the layout of blocks that haven't changed.
+def toTeletextBlock(input,maxWidth=40,line=1,variable={},cache=None):
+	if cache is not None:
+		key = cache.key(input, maxWidth, line, variable)
+		output = cache.get(key)
+		
+		if output is None:
+			output = toTeletextBlock(input, maxWidth, line, variable)
+			cache.put(key, output)
+		
+		return [dict(packet) for packet in output]	# Callers are free to change what they get back
+	
 	output = []
 	previousFinal = ""
 	previousAlign = ""
@@ -284,16 +385,39 @@ def toTeletextBlock(input,maxWidth=40,line=1,variable={}):
 	#print("")
 	return output
 
+# Words end after whitespace, "/" or "-", and keep that delimiter. A run of newlines is a word of its own.
+# This gives the same words as re.split('(.+?(?:\s|\/|\-|$))', text) without the lazy backtracking.
+wordPattern = re.compile(r"\n+|.[^\s/\-]*[\s/\-]?")
+
+# Split text into words in one pass, breaking up any word longer than limit so it can wrap over several rows
+def splitWords(text, limit):
+	words = wordPattern.findall(text)
+	
+	if limit < 1 or max(map(len, words), default=0) <= limit:
+		return words
+	
+	output = []
+	for word in words:
+		if len(word) > limit:
+			pieces = [word[position:position + limit] for position in range(0, len(word), limit)]
+			if len(pieces[-1]) == 1 and word[-1] in "/-" and limit > 1:	# Keep a "/" or "-" with the end of its word, not on a row of its own
+				pieces[-2:] = [pieces[-2][:-1], pieces[-2][-1] + pieces[-1]]
+			output += pieces
+		else:
+			output.append(word)
+	
+	return output
+
 def textColour(input,maxWidth=20,cursor=0,indent=0,forceNewLine=False,variable={},defaultColour=" ",doubleHeight=False):
 	line = 0
-	output = [""]
+	rows = [[]]	# Each row is built up as a list of parts, and joined once at the end
 	
 	width = maxWidth	# We redefine this here in case we want to do nth line offsets later
 	
 	if forceNewLine:
 		line += 1	# Increment the line counter (ToDo: Double Height needs incremented twice)
 		cursor = 0	# Carriage return
-		output.append("")	# Create the next row
+		rows.append([])	# Create the next row
 		width = maxWidth-indent	# Reset the width
 	
 	for chunk in input:
@@ -316,7 +440,7 @@ def textColour(input,maxWidth=20,cursor=0,indent=0,forceNewLine=False,variable={
 			focusText = str(variable_part)
 		elif "text" not in chunk and "variable" not in chunk:
 			print("textColour: Major fault, no usable text in chunk")
-			return output
+			return ["".join(row) for row in rows]
 		elif "text" in chunk:
 			focusText = str(chunk["text"])
 		
@@ -352,7 +476,7 @@ def textColour(input,maxWidth=20,cursor=0,indent=0,forceNewLine=False,variable={
 			cursor = 0	# Carriage return
 			
 			for i in range(chunk["lineOffset"]):
-				output.append("")	# Create the next row
+				rows.append([])	# Create the next row
 			
 			colourChanged = True	# Reset the colour
 			width = maxWidth-indent	# Reset the width
@@ -360,8 +484,7 @@ def textColour(input,maxWidth=20,cursor=0,indent=0,forceNewLine=False,variable={
 		if "preferNewline" in chunk:
 			chunkElement = [focusText]
 		else:
-			chunkElement = re.split('(.+?(?:\s|\/|\-|$))', focusText)	# Split chunk into words, retaining the delimiter
-			# ToDo - make sure the delimiter stays with the word, rather than floating on it's own
+			chunkElement = splitWords(focusText, min(width, maxWidth-indent) - (0 if "noSpacing" in chunk else 1))	# Split chunk into words, retaining the delimiter
 		
 		for word in chunkElement:
 			wordLen = len(word)	# How long is that word?
@@ -370,35 +493,28 @@ def textColour(input,maxWidth=20,cursor=0,indent=0,forceNewLine=False,variable={
 				continue
 			
 			if(wordLen+cursor) >= width+1:	# Is it gonna be too long for this line?
-				if wordLen > width:	# Wait, is it longer than the entire line?
-					print("textColour: Caught word \"" + word + "\" which is too long to fit in " + str(maxWidth) + " characters")	# "uncaught exception"
-					word = word[:width]
-					#exit()	# This shouldn't ever happen, but just in case - ToDo: Split up words that are too long to force them to fit
-				
 				if word == " ":
 					continue	# Don't put spaces at the start of new lines
 				
 				line += 1	# Increment the line counter (ToDo: Double Height needs incremented twice)
 				cursor = 0	# Carriage return
-				output.append("")	# Create the next row
+				rows.append([])	# Create the next row
 				colourChanged = True	# Reset the colour
 				width = maxWidth-indent	# Reset the width
 			
 			if colourChanged and "noSpacing" not in chunk:	# Add the colour code again if we need to
 				colourChanged = False
-				output[line] = output[line] + colour
+				rows[line].append(colour)
 				
 				if doubleHeight == True:
 					cursor = cursor + 1	# Need to increment the cursor for colour codes
 				else:
 					cursor = cursor + 1	# Need to increment the cursor for colour codes
-			#else:
-			#	output[line] = output[line] + " "	# Otherwise pad with a space
 			
-			output[line] = output[line] + word	# Add the word to the line
+			rows[line].append(word)	# Add the word to the line
 			cursor = cursor + wordLen	# And increment the cursor
 	
-	return(output)
+	return ["".join(row) for row in rows]
 
 #print(toTeletextBlock(textBlock6))
 
@@ -1,9 +1,58 @@
-import requests
-import copy
-from bs4 import BeautifulSoup
-from textBlock import toTeletextBlock
-from page import exportTTI, loadTTI
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import threading
+import time
+from textBlock import toTeletextBlock, LayoutCache
+from page import exportPages, templatePackets
 from legaliser import pageLegaliser
+from publish import publishFile
+import metrics
+from buienradar import FeedClient, FeedCache, StationIndex, feed_url
+
+# Blijft warm tussen verversingen in daemon-modus
+feed = FeedClient(feed_url)
+layoutCache = LayoutCache(maxsize=64)
+pool = None
+
+# Laatste goede feed, in het geheugen en (met --cache) op schijf, zodat storingen bij buienradar
+# de pagina's niet van de lucht halen. Zie buienradar.FeedCache voor wat er in een ingang zit
+feed_cache = None
+laatste_feed = None
+verouderd_na = 30 * 60  # Daarna zegt de voettekst er "verouderd" bij
+
+# Per paginanummer de hash van alles waar de laatst gepubliceerde pagina uit is opgemaakt.
+# Is de invoer niet veranderd, dan slaan we opmaken, legaliseren en exporteren helemaal over.
+# Verhoog render_versie als de opmaak verandert, zodat alle pagina's opnieuw gemaakt worden
+render_versie = 1
+uitvoer_map = "teletext"
+invoer_bestand = os.path.join(uitvoer_map, ".weertekst-invoer.json")
+gepubliceerde_invoer = None
+altijd_renderen = False
+
+# Waar de metingen per ronde heen gaan (met --metrics-prom en --metrics-json); zonder allebei staat metrics uit
+metrics_prom = None
+metrics_json = None
+
+# Welke stations op welke pagina komen, op naam of stationid. Aan te passen met --paginas of --alle-stations
+standaard_paginas = {"meetstation schiphol": 300}
+paginas = dict(standaard_paginas)
+alle_stations_vanaf = None  # Paginanummer voor het eerste station als alle stations een pagina krijgen
+# Met --alle-stations houdt elk station (op stationid) zijn pagina, ook als er stations uit de feed verdwijnen.
+# Nieuwe stations krijgen de eerstvolgende vrije pagina
+stations_bestand = os.path.join(uitvoer_map, ".weertekst-stations.json")
+station_paginas = None
+overzicht_pagina = None  # Paginanummer voor warmste/koudste nu, over alle stations
+processen = os.cpu_count() or 1
+
+# weather_page.tti is gemaakt voor Schiphol; voor andere stations passen we de kop en de bronregel aan
+template_station = "meetstation schiphol"
 
 # Functie om windrichting in graden om te zetten naar kompasrichting
 def windrichting_naar_kompas(graden):
@@ -16,27 +65,19 @@ def windrichting_naar_kompas(graden):
     except (ValueError, TypeError, ZeroDivisionError):
         return "Onbekend"
 
-# JSON-feed ophalen voor weerinformatie
-url = "https://data.buienradar.nl/2.0/feed/json"
-response = requests.get(url)
-data = response.json()
-
-# Zoek naar "Meetstation Schiphol"
-stations = data['actual']['stationmeasurements']
-schiphol = next(
-    (s for s in stations if s['stationname'].strip().lower() == 'meetstation schiphol'),
-    None
-)
-
-# Verkrijg de weergegevens
-if schiphol:
-    temperature = schiphol.get('temperature')
-    cloudcover = schiphol.get('cloudcoverpercentage', 0)
-    humidity = schiphol.get('humidity')
-    windspeed_ms = schiphol.get('windspeed')  # in m/s
-    windspeed_kmh = round(windspeed_ms * 3.6, 1) if windspeed_ms is not None else None
-    wind_direction = schiphol.get('winddirection')  # Kompasrichting (bijv. ZO)
-    wind_direction_degrees = schiphol.get('winddirectiondegrees')  # Graden (bijv. 128°)
+# JSON-feed ophalen voor weerinformatie, alleen de stations die we nodig hebben (None: alle). Geeft (data, veranderd) terug
+def haal_feed_op(stations=('meetstation schiphol',)):
+    return feed.haal_selectie(stations)
+
+# Zoek een meetstation op naam of stationid, bijvoorbeeld "Meetstation Schiphol"
+def zoek_station(index, naam='meetstation schiphol'):
+    return index.zoek(naam)
+
+# Verkrijg de weergegevens die op de pagina komen
+def weergegevens(station, data):
+    windspeed_ms = station.get('windspeed')  # in m/s
+    wind_direction = station.get('winddirection')  # Kompasrichting (bijv. ZO)
+    wind_direction_degrees = station.get('winddirectiondegrees')  # Graden (bijv. 128°)
 
     # Gebruik windrichting in kompasvorm als beschikbaar, anders gebruik de graden
     if wind_direction:
@@ -58,54 +99,456 @@ if schiphol:
         else:
             rain_chance = "0%"
 
-    # Creëer de teletext-pagina voor het weer
-    weatherPageTemplate = loadTTI("weather_page.tti")
-    teletextPage = {"number": 300, "subpages": [{"packets": copy.deepcopy(weatherPageTemplate["subpages"][0]["packets"])}]}
+    return {
+        "temperature": station.get('temperature'),
+        "cloudcover": station.get('cloudcoverpercentage', 0),
+        "humidity": station.get('humidity'),
+        "windspeed_kmh": round(windspeed_ms * 3.6, 1) if windspeed_ms is not None else None,
+        "wind_direction_str": wind_direction_str,
+        "rain_chance": rain_chance,
+    }
+
+# Vervang de tekst van templaterijen (rijnummer -> tekst), met behoud van de kleurcode vooraan.
+# Lange stationsnamen worden op 40 tekens afgekapt, zodat de rij niet over de rand loopt
+def vervang_kop(packets, kop):
+    return [
+        dict(packet, text=(packet["text"][0] + kop[packet["number"]])[:40]) if packet["number"] in kop else packet
+        for packet in packets
+    ]
+
+# Creëer de teletext-pagina voor het weer
+def maak_pagina(gegevens, paginanummer=300, station=None, bijgewerkt=None):
+    with metrics.stage("template"):
+        teletextPage = {"number": paginanummer, "subpages": [{"packets": templatePackets("weather_page.tti", diskCache=True)}]}
     line = 7
 
+    if station is not None and station.get('stationname', '').strip().lower() != template_station:
+        naam = station.get('stationname', '').strip()
+        naam = naam[len("Meetstation "):] if naam.lower().startswith("meetstation ") else naam
+        kop = {5: f"Weer {station.get('regio') or naam}:", 21: f"*Weerdata is van weerstation {naam}"}
+        teletextPage["subpages"][0]["packets"] = vervang_kop(teletextPage["subpages"][0]["packets"], kop)
+
+    regels = [
+        ("yellow", f"Temperatuur: {gegevens['temperature']} °C"),
+        ("white", f"Bewolking: {gegevens['cloudcover']}%"),
+        ("white", f"Luchtvochtigheid: {gegevens['humidity']}%"),
+    ]
+
+    if gegevens['windspeed_kmh'] is not None:
+        regels.append(("white", f"Windsnelheid: {gegevens['windspeed_kmh']} km/u ({gegevens['wind_direction_str']})"))
+    else:
+        regels.append(("white", "Windsnelheid: Niet beschikbaar"))
+
+    regels.append(("white", f"Neerslagkans: {gegevens['rain_chance']}"))
+
     # Voeg weerinformatie toe aan de teletext-pagina
-    paraBlock = toTeletextBlock(
-        input={"content": [{"align": "left", "content": [{"colour": "yellow", "text": f"Temperatuur: {temperature} °C"}]}]},
-        line=line
-    )
-    line += len(paraBlock) + 1
-    teletextPage["subpages"][0]["packets"] += paraBlock
+    with metrics.stage("layout"):
+        for kleur, tekst in regels:
+            paraBlock = toTeletextBlock(
+                input={"content": [{"align": "left", "content": [{"colour": kleur, "text": tekst}]}]},
+                line=line,
+                cache=layoutCache
+            )
+            line += len(paraBlock) + 1
+            teletextPage["subpages"][0]["packets"] += paraBlock
 
-    paraBlock = toTeletextBlock(
-        input={"content": [{"align": "left", "content": [{"colour": "white", "text": f"Bewolking: {cloudcover}%"}]}]},
-        line=line
-    )
-    line += len(paraBlock) + 1
-    teletextPage["subpages"][0]["packets"] += paraBlock
+        if bijgewerkt:
+            teletextPage["subpages"][0]["packets"] += voettekst(bijgewerkt)
 
-    paraBlock = toTeletextBlock(
-        input={"content": [{"align": "left", "content": [{"colour": "white", "text": f"Luchtvochtigheid: {humidity}%"}]}]},
-        line=line
+    return teletextPage
+
+# Hoe oud de gegevens zijn, op rij 22 onder de bronvermelding
+def voettekst(bijgewerkt):
+    return toTeletextBlock(
+        input={"content": [{"align": "left", "content": [{"colour": "white", "text": bijgewerkt}]}]},
+        line=22,
+        cache=layoutCache
     )
-    line += len(paraBlock) + 1
-    teletextPage["subpages"][0]["packets"] += paraBlock
-
-    if windspeed_kmh is not None:
-        paraBlock = toTeletextBlock(
-            input={"content": [{"align": "left", "content": [{"colour": "white", "text": f"Windsnelheid: {windspeed_kmh} km/u ({wind_direction_str})"}]}]},
-            line=line
-        )
-        line += len(paraBlock) + 1
-        teletextPage["subpages"][0]["packets"] += paraBlock
+
+def bijgewerkt_tekst(opgehaald, nu=None):
+    nu = nu or time.time()
+    tijd = time.localtime(opgehaald)
+    if time.localtime(nu)[:3] == tijd[:3]:
+        tekst = time.strftime("Bijgewerkt om %H:%M", tijd)
     else:
-        paraBlock = toTeletextBlock(
-            input={"content": [{"align": "left", "content": [{"colour": "white", "text": "Windsnelheid: Niet beschikbaar"}]}]},
-            line=line
-        )
-        line += len(paraBlock) + 1
-        teletextPage["subpages"][0]["packets"] += paraBlock
-
-    paraBlock = toTeletextBlock(
-        input={"content": [{"align": "left", "content": [{"colour": "white", "text": f"Neerslagkans: {rain_chance}"}]}]},
-        line=line
-    )
-    line += len(paraBlock) + 1
-    teletextPage["subpages"][0]["packets"] += paraBlock
+        tekst = time.strftime("Bijgewerkt op %d-%m om %H:%M", tijd)
+    if nu - opgehaald > verouderd_na:
+        tekst += " (verouderd)"
+    return tekst
+
+# Overzichtspagina met de warmste en koudste stations en de meeste wind, uit een metingen.MeetTabel
+def maak_overzicht(tabel, paginanummer, bijgewerkt=None):
+    with metrics.stage("template"):
+        teletextPage = {"number": paginanummer, "subpages": [{"packets": templatePackets("weather_page.tti", diskCache=True)}]}
+    kop = {5: "Weer in Nederland nu:", 21: f"*Weerdata van {len(tabel)} weerstations"}
+    teletextPage["subpages"][0]["packets"] = vervang_kop(teletextPage["subpages"][0]["packets"], kop)
+
+    def naam(i):
+        naam = tabel.namen[i]
+        return naam[len("Meetstation "):] if naam.lower().startswith("meetstation ") else naam
+
+    regels = [("yellow", "Warmst:")]
+    regels += [("white", f"{naam(i)}: {tabel['temperature'][i]:.1f} °C") for i in tabel.warmste(3)]
+    regels += [None, ("yellow", "Koudst:")]
+    regels += [("white", f"{naam(i)}: {tabel['temperature'][i]:.1f} °C") for i in tabel.koudste(3)]
+    regels += [None, ("yellow", "Meeste wind:")]
+    regels += [("white", f"{naam(i)}: {int(tabel['beaufort'][i])} Bft {tabel.kompas[i]}") for i in tabel.rangschik("windspeed", 2)]
+
+    line = 7
+    blokken = []
+    with metrics.stage("layout"):
+        for regel in regels:
+            if regel is None:
+                line += 1
+                continue
+            kleur, tekst = regel
+            paraBlock = toTeletextBlock(
+                input={"content": [{"align": "left", "content": [{"colour": kleur, "text": tekst}]}]},
+                line=line,
+                cache=layoutCache
+            )
+            line += len(paraBlock)
+            blokken += paraBlock
+
+        # Lege templaterijen waar nu tekst komt, moeten weg
+        gebruikt = {packet["number"] for packet in blokken}
+        teletextPage["subpages"][0]["packets"] = [packet for packet in teletextPage["subpages"][0]["packets"] if packet["number"] not in gebruikt] + blokken
+
+        if bijgewerkt:
+            teletextPage["subpages"][0]["packets"] += voettekst(bijgewerkt)
+
+    return teletextPage
+
+# Eén pagina opmaken en legaliseren. Draait in een werkproces, dus alles gaat erin en eruit als gewone dicts
+def render_pagina(opdracht):
+    gegevens, station, paginanummer, bijgewerkt = opdracht
+    teletextPage = maak_pagina(gegevens, paginanummer, station, bijgewerkt)
+    with metrics.stage("legalise"):
+        return pageLegaliser(teletextPage, fast=True)
+
+# In een werkproces: geef de metingen van deze ene pagina mee terug, het hoofdproces telt ze op
+def render_in_werker(opdracht):
+    if not metrics.enabled:
+        return render_pagina(opdracht), None
+    metrics.reset()
+    return render_pagina(opdracht), metrics.snapshot()
+
+def start_werker(metingen_aan):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Stoppen regelt het hoofdproces
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    metrics.enabled = metingen_aan
+
+# Opmaken is puur Python, dus bij meer dan een paar pagina's verdelen we het over processen.
+# De pool blijft bestaan tussen verversingen, net als de layoutCache in elk werkproces.
+# Werkprocessen komen uit een forkserver (of spawn), niet uit een fork van dit proces: tijdens het
+# publiceren kan de ververser-thread nog locks vasthouden (requests, logging, metrics)
+def render_paginas(opdrachten):
+    global pool
+    if processen <= 1 or len(opdrachten) < 4:
+        return [render_pagina(opdracht) for opdracht in opdrachten]
+
+    if pool is None:
+        context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=processen, mp_context=context, initializer=start_werker, initargs=(metrics.enabled,))
+
+    teletextPages = []
+    for teletextPage, metingen in pool.map(render_in_werker, opdrachten, chunksize=max(1, len(opdrachten) // (processen * 4))):
+        teletextPages.append(teletextPage)
+        if metingen is not None:
+            metrics.merge(metingen)
+    return teletextPages
+
+def sluit_pool():
+    global pool
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+
+# Welke stations uit de feed op welke pagina komen, als (station, paginanummer)
+def kies_stations(index):
+    if alle_stations_vanaf is not None:
+        return kies_alle_stations(index)
+
+    gekozen = []
+    for sleutel, paginanummer in paginas.items():
+        station = zoek_station(index, sleutel)
+        if station is None:
+            logging.warning("Station %s niet gevonden in de feed, pagina %s blijft staan", sleutel, paginanummer)
+        else:
+            gekozen.append((station, paginanummer))
+    return gekozen
+
+def lees_station_paginas():
+    try:
+        with open(stations_bestand, encoding="utf-8") as f:
+            opgeslagen = json.load(f)
+        if opgeslagen["vanaf"] == alle_stations_vanaf:
+            return {int(stationid): int(paginanummer) for stationid, paginanummer in opgeslagen["stations"].items()}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return {}
+
+# Elk station op de pagina die het de eerste keer kreeg. Ontbreekt een station, dan blijft zijn pagina
+# staan zoals hij was, in plaats van dat alle stations erna een pagina opschuiven
+def kies_alle_stations(index):
+    global station_paginas
+    if station_paginas is None:
+        station_paginas = lees_station_paginas()
+
+    gekozen = []
+    nieuw = False
+    for station in sorted(index.stations, key=lambda s: s.get('stationname', '')):
+        stationid = station.get('stationid')
+        if not isinstance(stationid, int):
+            logging.warning("Station %s heeft geen stationid, geen pagina", station.get('stationname'))
+            continue
+        if stationid not in station_paginas:
+            station_paginas[stationid] = max(station_paginas.values(), default=alle_stations_vanaf - 1) + 1
+            nieuw = True
+        gekozen.append((station, station_paginas[stationid]))
+
+    ontbrekend = station_paginas.keys() - {station.get('stationid') for station, paginanummer in gekozen}
+    for stationid in sorted(ontbrekend):
+        logging.warning("Station %s niet gevonden in de feed, pagina %s blijft staan", stationid, station_paginas[stationid])
+
+    if nieuw:
+        try:
+            publishFile(stations_bestand, json.dumps({"vanaf": alle_stations_vanaf, "stations": station_paginas}, sort_keys=True).encode("utf-8"))
+        except OSError as e:
+            logging.warning("Stationpagina's niet bewaard: %s", e)
+    return gekozen
+
+# Lees een stations-naar-pagina's kaart, bijvoorbeeld {"Meetstation Schiphol": 300, "6260": 301}
+def lees_paginakaart(bestand):
+    with open(bestand, encoding="utf-8") as f:
+        return {str(station): int(paginanummer) for station, paginanummer in json.load(f).items()}
+
+# Welke stations we uit de feed halen: None voor allemaal, anders de sleutels uit de paginakaart
+def stationselectie():
+    if alle_stations_vanaf is not None or overzicht_pagina is not None:
+        return None
+    return sorted(str(sleutel) for sleutel in paginas)
+
+def invoer_hash(*invoer):
+    return hashlib.blake2b(json.dumps(invoer, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"), digest_size=16).hexdigest()
+
+def lees_gepubliceerde_invoer():
+    try:
+        with open(invoer_bestand, encoding="utf-8") as f:
+            return {int(paginanummer): sleutel for paginanummer, sleutel in json.load(f).items()}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+# Is deze pagina al precies zo gepubliceerd (en staat hij er nog)?
+def al_gepubliceerd(paginanummer, sleutel):
+    if altijd_renderen or gepubliceerde_invoer.get(paginanummer) != sleutel:
+        return False
+    return os.path.exists(os.path.join(uitvoer_map, "P" + str(paginanummer) + ".tti"))
+
+# Alle pagina's opmaken en exporteren uit een feed-ingang, behalve die waarvan de invoer niet veranderd is
+def publiceer(ingang):
+    global gepubliceerde_invoer
+    if gepubliceerde_invoer is None:
+        gepubliceerde_invoer = lees_gepubliceerde_invoer()
+
+    data = ingang["data"]
+    bijgewerkt = bijgewerkt_tekst(ingang["opgehaald"])
+    try:
+        template = os.stat("weather_page.tti")
+        template = (template.st_mtime_ns, template.st_size)
+    except OSError:
+        template = None  # Dan gaat het bij het opmaken vanzelf mis
+    sleutels = {}
+
+    # Alleen de waarden die op de pagina komen gaan mee naar de werkprocessen, en in de hash
+    opdrachten = []
+    with metrics.stage("lookup"):
+        index = StationIndex(data.get('actual', {}).get('stationmeasurements', []))
+        for station, paginanummer in kies_stations(index):
+            gegevens = weergegevens(station, data)
+            kop = {sleutel: station.get(sleutel) for sleutel in ('stationname', 'regio')}
+            sleutel = invoer_hash(render_versie, template, paginanummer, gegevens, kop, bijgewerkt)
+            if not al_gepubliceerd(paginanummer, sleutel):
+                sleutels[paginanummer] = sleutel
+                opdrachten.append((gegevens, kop, paginanummer, bijgewerkt))
+            else:
+                metrics.count("pages_skipped")
+    teletextPages = render_paginas(opdrachten)
+
+    if overzicht_pagina is not None:
+        waarden = [[s.get(veld) for veld in ('stationname', 'temperature', 'windspeed', 'winddirectiondegrees')] for s in index.stations]
+        sleutel = invoer_hash(render_versie, template, overzicht_pagina, waarden, bijgewerkt)
+        if not al_gepubliceerd(overzicht_pagina, sleutel):
+            from metingen import MeetTabel  # NumPy is alleen nodig voor de overzichtspagina
+            sleutels[overzicht_pagina] = sleutel
+            overzicht = maak_overzicht(MeetTabel(index.stations), overzicht_pagina, bijgewerkt)
+            with metrics.stage("legalise"):
+                teletextPages.append(pageLegaliser(overzicht, fast=True))
+        else:
+            metrics.count("pages_skipped")
+
+    if not teletextPages:
+        logging.info("Invoer van alle pagina's onveranderd, niets opgemaakt")
+        return
+
+    # Exporteer de teletext-pagina's
+    with metrics.stage("export"):
+        resultaten = exportPages(teletextPages, directory=uitvoer_map, incremental=True)
+
+    for teletextPage, resultaat in zip(teletextPages, resultaten):
+        metrics.count("pages_" + resultaat["status"])
+        metrics.count("export_warnings", len(resultaat["warnings"]))
+        metrics.count("truncation_warnings", sum("longer than 40" in warning for warning in resultaat["warnings"]))
+        if resultaat["status"] == "error":
+            logging.error("Pagina %s niet geschreven: %s", resultaat["number"], resultaat["error"])
+        else:
+            gepubliceerde_invoer[resultaat["number"]] = sleutels[resultaat["number"]]
+            if resultaat["status"] == "written":
+                metrics.count("packets_written", len(teletextPage.get("packets", [])) + sum(len(subpage["packets"]) for subpage in teletextPage["subpages"]))
+
+    try:
+        publishFile(invoer_bestand, json.dumps(gepubliceerde_invoer, sort_keys=True).encode("utf-8"))
+    except OSError as e:
+        logging.warning("Invoerhashes niet bewaard: %s", e)
+
+# Haal de feed opnieuw op en werk laatste_feed (en de cache op schijf) bij.
+# Geeft True terug als er nieuwe gegevens zijn, None bij een storing; dan blijft de laatste goede feed staan
+def vernieuw():
+    global laatste_feed
+    try:
+        data, veranderd = haal_feed_op(stationselectie())
+    except Exception as e:  # Netwerk, HTTP-fouten en kapotte JSON: allemaal geen reden om de pagina's weg te halen
+        logging.warning("Feed ophalen mislukt (%s), de laatste goede feed blijft staan", e)
+        metrics.count("feed_errors")
+        return None
+
+    nu = time.time()
+    if veranderd or laatste_feed is None:
+        laatste_feed = {"data": data, "opgehaald": nu}
+    laatste_feed.update(gevalideerd=nu, etag=feed.etag, last_modified=feed.last_modified)
+
+    if feed_cache is not None:
+        try:
+            feed_cache.bewaar(laatste_feed, stationselectie())
+        except OSError as e:
+            logging.warning("Feedcache niet bewaard: %s", e)
+
+    return veranderd
+
+# Eén volledige verversing. Is de laatste goede feed nog vers, dan halen we niets op.
+# Anders gaat de verouderde feed meteen de lucht in terwijl de nieuwe op de achtergrond wordt opgehaald
+# (stale-while-revalidate); komt er iets nieuws binnen, dan publiceren we nog een keer
+def ververs():
+    global laatste_feed
+    if laatste_feed is None and feed_cache is not None:
+        laatste_feed = feed_cache.laad(stationselectie())
+        if laatste_feed is not None:
+            feed.herstel(laatste_feed)
+
+    if laatste_feed is not None and feed_cache is not None and feed_cache.vers(laatste_feed):
+        publiceer(laatste_feed)
+        return
+
+    uitkomst = {}
+    ververser = threading.Thread(target=lambda: uitkomst.update(veranderd=vernieuw()), daemon=True)
+    ververser.start()
+
+    vorige = laatste_feed
+    if vorige is not None:
+        publiceer(vorige)
+
+    ververser.join()
+    if laatste_feed is None:
+        logging.warning("Nog geen goede feed gehad, geen pagina's gepubliceerd")
+    elif uitkomst.get("veranderd") or vorige is None:
+        publiceer(laatste_feed)
+    elif uitkomst.get("veranderd") is False:
+        logging.info("Feed niet veranderd, pagina's blijven staan")
+
+# Eén ronde, met de tijd van de hele ronde erbij, en daarna de metingen wegschrijven
+def ronde():
+    try:
+        with metrics.stage("cycle"):
+            ververs()
+    finally:
+        schrijf_metingen()
+
+def schrijf_metingen():
+    try:
+        if metrics_prom:
+            metrics.writePrometheus(metrics_prom, prefix="weertekst")
+        if metrics_json:
+            metrics.writeJSON(metrics_json)
+    except OSError as e:
+        logging.warning("Metingen niet geschreven: %s", e)
+
+# Blijf verversen tot we een SIGTERM of SIGINT krijgen
+# Elke ronde start interval seconden na de vorige, plus of min een willekeurige jitter,
+# zodat meerdere generators niet allemaal tegelijk de feed ophalen
+def draai_daemon(interval=60, jitter=5):
+    stoppen = threading.Event()
+
+    def stop(signum, frame):
+        logging.info("Signaal %s ontvangen, stoppen na deze ronde", signum)
+        stoppen.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    volgende = time.monotonic()
+    while not stoppen.is_set():
+        try:
+            ronde()
+        except Exception:
+            logging.exception("Verversen mislukt, volgende ronde proberen we het opnieuw")
+
+        volgende += interval
+        wachttijd = max(0, volgende + random.uniform(-jitter, jitter) - time.monotonic())
+        if wachttijd == 0:
+            volgende = time.monotonic()  # We lopen achter, niet proberen in te halen
+        stoppen.wait(wachttijd)
+
+    sluit_pool()
+
+def main():
+    global paginas, alle_stations_vanaf, overzicht_pagina, processen, feed_cache, altijd_renderen, metrics_prom, metrics_json
+    parser = argparse.ArgumentParser(description="Weerpagina voor teletekst uit de buienradar-feed")
+    parser.add_argument("--daemon", action="store_true", help="blijf draaien en ververs elke --interval seconden (standaard: één keer, voor cron)")
+    parser.add_argument("--interval", type=float, default=60, help="seconden tussen verversingen in daemon-modus")
+    parser.add_argument("--jitter", type=float, default=5, help="maximale willekeurige afwijking van het interval, in seconden")
+    parser.add_argument("--url", default=feed_url, help="adres van de feed, bijvoorbeeld een lokale feedreplay.py")
+    parser.add_argument("--paginas", help="JSON-bestand met stations (naam of stationid) en hun paginanummer")
+    parser.add_argument("--alle-stations", type=int, metavar="PAGINA", help="elk station in de feed een pagina geven, vanaf dit paginanummer")
+    parser.add_argument("--overzicht", type=int, metavar="PAGINA", help="pagina met de warmste en koudste stations (vraagt om NumPy)")
+    parser.add_argument("--cache", default="buienradar.cache", help="bestand voor de laatste goede feed (leeg: geen cache op schijf)")
+    parser.add_argument("--ttl", type=float, default=60, help="seconden dat de laatste feed vers is en er niets opgehaald wordt")
+    parser.add_argument("--altijd-renderen", action="store_true", help="ook pagina's opmaken waarvan de invoer niet veranderd is")
+    parser.add_argument("--metrics-prom", metavar="BESTAND", help="tijden per stap en tellers als Prometheus textfile, na elke ronde")
+    parser.add_argument("--metrics-json", metavar="BESTAND", help="dezelfde metingen als JSON-samenvatting")
+    parser.add_argument("--processen", type=int, default=processen, help="aantal processen voor het opmaken van de pagina's")
+    args = parser.parse_args()
+
+    feed.url = args.url
+    if args.paginas:
+        paginas = lees_paginakaart(args.paginas)
+    alle_stations_vanaf = args.alle_stations
+    overzicht_pagina = args.overzicht
+    processen = args.processen
+    altijd_renderen = args.altijd_renderen
+    metrics_prom = args.metrics_prom
+    metrics_json = args.metrics_json
+    metrics.enabled = bool(metrics_prom or metrics_json)
+    if args.cache:
+        feed_cache = FeedCache(args.cache, args.ttl)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.daemon:
+        draai_daemon(args.interval, args.jitter)
+    else:
+        try:
+            ronde()
+        finally:
+            sluit_pool()
 
-    # Exporteer de teletext-pagina
-    exportTTI(pageLegaliser(teletextPage))
+if __name__ == '__main__':
+    main()